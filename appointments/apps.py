@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class AppointmentsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'appointments'
+
+    def ready(self):
+        # Signal receivers are connected here, once the app registry is ready, rather than as a side effect
+        # of whichever module happens to import them first
+        from . import page_cache, ratings, search, stats
+
+        page_cache.connect_signals()
+        ratings.connect_signals()
+        search.connect_signals()
+        stats.connect_signals()
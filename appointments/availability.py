@@ -0,0 +1,395 @@
+import calendar
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, OperationalError, transaction
+
+from .models import Appointment
+from .models import Slot
+from .cache_versions import acache_version, bump_cache_version, cache_version
+from .db_router import use_primary
+from .expiry import hold_for_confirmation
+from .stats import increment_statistic
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+# Losing a booking race: select_for_update is a no-op on SQLite, where the loser can't get the write lock
+# ("database is locked"); with a unique (doctor_id, start_date, start_time) index the second insert fails
+CLAIM_RACE_ERRORS = (IntegrityError, OperationalError)
+
+# SQLSTATEs of the races a claim is designed to lose: unique violation, and serialization failure,
+# deadlock and lock timeout. Every other database error is a real failure and propagates.
+UNIQUE_VIOLATION = '23505'
+LOCK_CONTENTION = {'40001', '40P01', '55P03'}
+
+
+def _sqlstate(error):
+    cause = error.__cause__
+    return getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+
+
+def lost_claim_race(error):
+    # SQLite and MySQL carry no SQLSTATE on the driver error, so their messages are matched instead
+    message = str(error).lower()
+    if isinstance(error, IntegrityError):
+        return (
+            _sqlstate(error) == UNIQUE_VIOLATION
+            or message.startswith('unique constraint failed')
+            or 'duplicate entry' in message
+        )
+    if isinstance(error, OperationalError):
+        return (
+            _sqlstate(error) in LOCK_CONTENTION
+            or 'database is locked' in message
+            or 'deadlock' in message
+            or 'lock wait timeout' in message
+        )
+    return False
+
+
+class SeriesConflict(SlotUnavailable):
+    def __init__(self, dates):
+        super().__init__('Some dates of the recurring series are not available.')
+        self.dates = dates
+
+
+# A weekly Slot row is the template; a reservation is an Appointment on a concrete date for that slot.
+# Availability for any horizon is therefore the slot template minus the claims in a date range.
+
+
+def booking_horizon():
+    # Number of days, starting today, that patients can book into
+    return getattr(settings, 'BOOKING_HORIZON_DAYS', 14)
+
+
+def horizon_dates(start_date, days=None):
+    days = booking_horizon() if days is None else days
+    return [start_date + timedelta(days=i) for i in range(days)]
+
+
+def overlaps(intervals, start_time, end_time):
+    # The one overlap rule used for listing slots and for claiming them: touching intervals don't overlap
+    return any(start < end_time and end > start_time for start, end in intervals)
+
+
+def _claims_query(doctor_id, start_date, end_date):
+    # One range query over the (doctor_id, start_date, start_time) index
+    return Appointment.objects.filter(
+        doctor_id=doctor_id,
+        start_date__gte=start_date,
+        start_date__lte=end_date,
+    ).values_list('start_date', 'start_time', 'end_time')
+
+
+def _group_claims(rows):
+    claims = {}
+    for date, start_time, end_time in rows:
+        claims.setdefault(date, []).append((start_time, end_time))
+    return claims
+
+
+def claimed_intervals(doctor_id, start_date, end_date):
+    # date -> [(start_time, end_time)] of every claim in the range
+    return _group_claims(_claims_query(doctor_id, start_date, end_date))
+
+
+async def aclaimed_intervals(doctor_id, start_date, end_date):
+    return _group_claims([row async for row in _claims_query(doctor_id, start_date, end_date)])
+
+
+def slot_is_claimed(doctor_id, date, start_time, end_time):
+    return Appointment.objects.filter(
+        doctor_id=doctor_id,
+        start_date=date,
+        start_time__lt=end_time,
+        end_time__gt=start_time,
+    ).exists()
+
+
+def claim_slot(doctor_id, date, start_time, end_time, **appointment_fields):
+    # Lock the weekly slot row, re-check the claim and insert the appointment in the same transaction,
+    # so two concurrent bookings of the same slot and date can't both succeed
+    try:
+        with transaction.atomic():
+            slot = Slot.objects.select_for_update().filter(
+                doctor_id=doctor_id,
+                day=date.strftime('%A'),
+                start_time=start_time,
+                end_time=end_time,
+            ).first()
+
+            if slot is None:
+                raise SlotUnavailable('The selected slot does not exist.')
+
+            if slot_is_claimed(doctor_id, date, start_time, end_time):
+                raise SlotUnavailable('The selected slot is already reserved.')
+
+            appointment = Appointment.objects.create(
+                doctor_id=doctor_id,
+                start_date=date,
+                start_time=start_time,
+                end_time=end_time,
+                **appointment_fields
+            )
+
+            if not appointment.status:
+                hold_for_confirmation([appointment])
+
+            return appointment
+    except CLAIM_RACE_ERRORS as error:
+        if not lost_claim_race(error):
+            raise
+        raise SlotUnavailable('The selected slot is already reserved.') from error
+
+
+def expand_series(start_date, end_date, repeat_every, repeat_unit):
+    # All occurrence dates of a recurring appointment, computed in memory
+    unit = (repeat_unit or '').lower().rstrip('s')
+    if repeat_every < 1 or unit not in ('day', 'week', 'month'):
+        raise ValueError('Invalid repeat interval.')
+    if end_date < start_date:
+        raise ValueError('The end date must not be before the start date.')
+
+    max_occurrences = getattr(settings, 'RECURRING_MAX_OCCURRENCES', 100)
+    dates = []
+    current_date = start_date
+    step = 0
+
+    while current_date <= end_date:
+        if len(dates) >= max_occurrences:
+            raise ValueError(f'A recurring series can have at most {max_occurrences} appointments.')
+
+        dates.append(current_date)
+        step += repeat_every
+
+        if unit == 'day':
+            current_date = start_date + timedelta(days=step)
+        elif unit == 'week':
+            current_date = start_date + timedelta(weeks=step)
+        else:
+            # Same day of the month, clamped to the last day of shorter months
+            month_index = start_date.month - 1 + step
+            year = start_date.year + month_index // 12
+            month = month_index % 12 + 1
+            day = min(start_date.day, calendar.monthrange(year, month)[1])
+            current_date = start_date.replace(year=year, month=month, day=day)
+
+    return dates
+
+
+def claim_series(doctor_id, dates, start_time, end_time, **appointment_fields):
+    # Check every occurrence with two batched queries and create the whole series at once, or nothing
+    try:
+        with transaction.atomic():
+            day_names = {date.strftime('%A') for date in dates}
+            slot_days = set(
+                Slot.objects.select_for_update().filter(
+                    doctor_id=doctor_id,
+                    day__in=day_names,
+                    start_time=start_time,
+                    end_time=end_time,
+                ).values_list('day', flat=True)
+            )
+            claimed_dates = set(
+                Appointment.objects.filter(
+                    doctor_id=doctor_id,
+                    start_date__in=dates,
+                    start_time__lt=end_time,
+                    end_time__gt=start_time,
+                ).values_list('start_date', flat=True)
+            )
+
+            conflicts = [
+                date for date in dates
+                if date.strftime('%A') not in slot_days or date in claimed_dates
+            ]
+            if conflicts:
+                raise SeriesConflict(conflicts)
+
+            appointments = Appointment.objects.bulk_create([
+                Appointment(
+                    doctor_id=doctor_id,
+                    start_date=date,
+                    start_time=start_time,
+                    end_time=end_time,
+                    **appointment_fields
+                )
+                for date in dates
+            ])
+
+            # bulk_create doesn't send post_save, so the site counter is bumped here
+            increment_statistic('appointments', len(appointments))
+
+            hold_for_confirmation([appointment for appointment in appointments if not appointment.status])
+
+            return appointments
+    except CLAIM_RACE_ERRORS as error:
+        if not lost_claim_race(error):
+            raise
+        # Which dates the concurrent booking took is unknown, so the whole series is reported
+        raise SeriesConflict(list(dates)) from error
+
+
+def _slot_template_query(doctor):
+    return Slot.objects.filter(doctor=doctor).order_by('start_time').values_list('day', 'start_time', 'end_time')
+
+
+def _format_slot(start_time, end_time):
+    return (start_time, end_time, {
+        'start_time': start_time.strftime('%I:%M %p'),
+        'end_time': end_time.strftime('%I:%M %p'),
+        'start_time_24h': start_time.strftime('%H:%M'),
+        'end_time_24h': end_time.strftime('%H:%M'),
+    })
+
+
+def _free_slots_by_date(dates, slots_by_day, claimed):
+    # A slot is free on a date unless some claim overlaps it, the same rule claim_slot enforces, so slot
+    # templates that overlap each other never list a slot that can't be booked
+    return {
+        date.strftime('%Y-%m-%d'): [
+            formatted
+            for start_time, end_time, formatted in slots_by_day.get(date.strftime('%A'), [])
+            if not overlaps(claimed.get(date, ()), start_time, end_time)
+        ]
+        for date in dates
+    }
+
+
+def available_slots_by_date(doctor, start_date=None, days=None):
+    # Availability for every date of the horizon: one query for the slot template, one for the claims
+    start_date = start_date or datetime.today().date()
+    dates = horizon_dates(start_date, days)
+
+    # Format each weekly slot once; the same dicts are reused for every matching date
+    slots_by_day = {}
+    for day, start_time, end_time in _slot_template_query(doctor):
+        slots_by_day.setdefault(day, []).append(_format_slot(start_time, end_time))
+
+    claimed = claimed_intervals(doctor.id, dates[0], dates[-1]) if dates else {}
+
+    return _free_slots_by_date(dates, slots_by_day, claimed)
+
+
+async def aavailable_slots_by_date(doctor, start_date=None, days=None):
+    start_date = start_date or datetime.today().date()
+    dates = horizon_dates(start_date, days)
+
+    slots_by_day = {}
+    async for day, start_time, end_time in _slot_template_query(doctor):
+        slots_by_day.setdefault(day, []).append(_format_slot(start_time, end_time))
+
+    claimed = await aclaimed_intervals(doctor.id, dates[0], dates[-1]) if dates else {}
+
+    return _free_slots_by_date(dates, slots_by_day, claimed)
+
+
+def availability_cache():
+    return caches[getattr(settings, 'AVAILABILITY_CACHE_ALIAS', 'default')]
+
+
+def _availability_version(doctor_id):
+    return cache_version(availability_cache(), f'availability-version:{doctor_id}')
+
+
+def _bump_availability_version(doctor_id):
+    bump_cache_version(availability_cache(), f'availability-version:{doctor_id}')
+
+
+def invalidate_availability(doctor_id):
+    # Called by every view that changes a doctor's slots or claims; old entries simply stop being read.
+    # The bump waits for the commit: before it, a concurrent reader would cache the old rows under the new
+    # version, and a rolled back change needs no invalidation at all.
+    transaction.on_commit(lambda: _bump_availability_version(doctor_id))
+
+
+def _count(name):
+    cache = availability_cache()
+    key = f'availability-cache:{name}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+
+def availability_cache_stats():
+    cache = availability_cache()
+    return {
+        'hits': cache.get('availability-cache:hits', 0),
+        'misses': cache.get('availability-cache:misses', 0),
+    }
+
+
+def _availability_key(doctor_id, today, days, version):
+    # The date is part of the key, so the payload rolls over at midnight when the dates shift
+    return f'availability:{doctor_id}:{today.isoformat()}:{days}:{version}'
+
+
+def _seconds_until_midnight(today):
+    midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+    return max(int((midnight - datetime.now()).total_seconds()) + 1, 1)
+
+
+def cached_available_slots_by_date(doctor):
+    today = datetime.today().date()
+    days = booking_horizon()
+
+    key = _availability_key(doctor.id, today, days, _availability_version(doctor.id))
+    cache = availability_cache()
+
+    slots_by_date = cache.get(key)
+    if slots_by_date is not None:
+        _count('hits')
+        return slots_by_date
+
+    _count('misses')
+
+    # Everyone shares the cached entry, so fill it from the primary rather than a lagging replica
+    with use_primary():
+        slots_by_date = available_slots_by_date(doctor, today, days)
+
+    cache.set(key, slots_by_date, timeout=_seconds_until_midnight(today))
+
+    return slots_by_date
+
+
+async def _aavailability_version(doctor_id):
+    return await acache_version(availability_cache(), f'availability-version:{doctor_id}')
+
+
+async def _acount(name):
+    cache = availability_cache()
+    key = f'availability-cache:{name}'
+    if not await cache.aadd(key, 1, timeout=None):
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            pass
+
+
+async def acached_available_slots_by_date(doctor):
+    # Same cache entries as cached_available_slots_by_date, for the async views
+    today = datetime.today().date()
+    days = booking_horizon()
+
+    key = _availability_key(doctor.id, today, days, await _aavailability_version(doctor.id))
+    cache = availability_cache()
+
+    slots_by_date = await cache.aget(key)
+    if slots_by_date is not None:
+        await _acount('hits')
+        return slots_by_date
+
+    await _acount('misses')
+
+    with use_primary():
+        slots_by_date = await aavailable_slots_by_date(doctor, today, days)
+
+    await cache.aset(key, slots_by_date, timeout=_seconds_until_midnight(today))
+
+    return slots_by_date
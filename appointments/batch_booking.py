@@ -0,0 +1,135 @@
+from datetime import datetime
+
+from django.db import transaction
+
+from .availability import booking_horizon
+from .availability import overlaps
+from .availability import invalidate_availability
+from .expiry import hold_for_confirmation
+from .models import Appointment
+from .models import Client
+from .models import Doctor
+from .models import Slot
+from .stats import increment_statistic
+
+
+def _parse_booking(item):
+    try:
+        doctor_id = int(item['doctor_id'])
+        client_id = int(item['client_id'])
+        date = datetime.strptime(item['date'], '%Y-%m-%d').date()
+        start_time = datetime.strptime(item['start_time'], '%H:%M').time()
+        end_time = datetime.strptime(item['end_time'], '%H:%M').time()
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Each booking needs doctor_id, client_id, date (YYYY-MM-DD), start_time and end_time (HH:MM).')
+
+    if start_time >= end_time:
+        raise ValueError('Start time must be earlier than end time.')
+
+    delta_days = (date - datetime.today().date()).days
+    if delta_days < 0:
+        raise ValueError('Selected date is in the past.')
+    if delta_days >= booking_horizon():
+        raise ValueError(f'Selected date is beyond the reservation period ({booking_horizon()} days).')
+
+    return doctor_id, client_id, date, start_time, end_time
+
+
+def book_batch(items):
+    # Book many appointments with a handful of IN queries. Returns (results, appointments) where results
+    # has one entry per item, in order, and appointments are the created rows.
+    results = [None] * len(items)
+    parsed = {}
+
+    for index, item in enumerate(items):
+        try:
+            parsed[index] = _parse_booking(item)
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 'error', 'message': str(e)}
+
+    doctor_ids = {booking[0] for booking in parsed.values()}
+    client_ids = {booking[1] for booking in parsed.values()}
+    dates = {booking[2] for booking in parsed.values()}
+
+    doctors = Doctor.objects.select_related('user').in_bulk(doctor_ids)
+    clients = {
+        client.user_id: client
+        for client in Client.objects.select_related('user').filter(user_id__in=client_ids)
+    }
+
+    with transaction.atomic():
+        # Lock the weekly slots involved, then read the claims, so concurrent bookings wait for us
+        slots = set(
+            Slot.objects.select_for_update().filter(
+                doctor_id__in=doctor_ids,
+                day__in={date.strftime('%A') for date in dates},
+            ).values_list('doctor_id', 'day', 'start_time', 'end_time')
+        )
+
+        claims = {}
+        for doctor_id, start_date, start_time, end_time in Appointment.objects.filter(
+            doctor_id__in=doctor_ids,
+            start_date__in=dates,
+        ).values_list('doctor_id', 'start_date', 'start_time', 'end_time'):
+            claims.setdefault((doctor_id, start_date), []).append((start_time, end_time))
+
+        new_appointments = []
+        booked_indexes = []
+        for index, (doctor_id, client_id, date, start_time, end_time) in parsed.items():
+            doctor = doctors.get(doctor_id)
+            client = clients.get(client_id)
+
+            if doctor is None or client is None:
+                results[index] = {'index': index, 'status': 'error', 'message': 'Doctor or client not found.'}
+                continue
+
+            if (doctor_id, date.strftime('%A'), start_time, end_time) not in slots:
+                results[index] = {'index': index, 'status': 'conflict', 'message': 'The selected slot does not exist.'}
+                continue
+
+            # Earlier items of the same batch claim their slot too
+            day_claims = claims.setdefault((doctor_id, date), [])
+            if overlaps(day_claims, start_time, end_time):
+                results[index] = {'index': index, 'status': 'conflict', 'message': 'The selected slot is already reserved.'}
+                continue
+            day_claims.append((start_time, end_time))
+
+            duration = datetime.combine(date, end_time) - datetime.combine(date, start_time)
+            new_appointments.append(Appointment(
+                doctor_id=doctor.id,
+                doctor_name=f"Dr. {doctor.user.first_name} {doctor.user.last_name}",
+                doctor_gender=doctor.gender,
+                doctor_contact=doctor.contact,
+                doctor_address=doctor.address,
+                doctor_clinic=doctor.clinic_hospital,
+
+                start_date=date,
+                start_time=start_time,
+                end_time=end_time,
+                duration=duration.seconds // 60,
+                status=False,
+                one_time_only=True,
+
+                client_id=client.user.id,
+                client_name=f"{client.user.first_name} {client.user.last_name}",
+                client_gender=client.gender,
+                client_contact=client.contact,
+                client_address=client.address,
+                client_date_of_birth=client.date_of_birth,
+            ))
+            booked_indexes.append(index)
+
+        appointments = Appointment.objects.bulk_create(new_appointments)
+
+        # bulk_create doesn't send post_save, so the site counter is bumped here
+        increment_statistic('appointments', len(appointments))
+
+        hold_for_confirmation(appointments)
+
+    for index, appointment in zip(booked_indexes, appointments):
+        results[index] = {'index': index, 'status': 'booked', 'appointment_id': appointment.id}
+
+    for doctor_id in {appointment.doctor_id for appointment in appointments}:
+        invalidate_availability(doctor_id)
+
+    return results, appointments
@@ -0,0 +1,498 @@
+import asyncio
+import json
+import resource
+import statistics
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from django.db import connection, connections, transaction
+from django.test import AsyncClient
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
+
+from .availability import booking_horizon, invalidate_availability
+from .models import Appointment, Doctor, Slot
+from .slots import build_slot_grid, doctor_availability, save_slot_grid
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def succeeded(status):
+    return 200 <= status < 400
+
+
+def summarize(latencies, query_counts, failures=0, **extra):
+    # Timings cover the successful runs only; when none succeeded there is nothing to time
+    if not latencies:
+        return dict({'runs': 0, 'failures': failures}, **extra)
+
+    return dict({
+        'runs': len(latencies),
+        'failures': failures,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'queries': max(query_counts),
+    }, **extra)
+
+
+def measure(request, iterations):
+    # request() performs one call and returns the response; latency and query count are taken around it.
+    # Error responses are counted as failures, not timed: a fast 400 or 500 would flatter the numbers.
+    latencies = []
+    query_counts = []
+    failures = 0
+    statuses = set()
+
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = request()
+            if getattr(response, 'streaming', False):
+                for _ in response.streaming_content:
+                    pass
+            latency = time.perf_counter() - start
+        statuses.add(response.status_code)
+
+        if succeeded(response.status_code):
+            latencies.append(latency)
+            query_counts.append(len(queries))
+        else:
+            failures += 1
+
+    return summarize(latencies, query_counts, failures, statuses=sorted(statuses))
+
+
+class BenchmarkContext:
+    # Picks representative rows from the seeded data once, shared by all scenarios
+    def __init__(self):
+        self.doctor = (
+            Doctor.objects.select_related('user')
+            .filter(id__in=Slot.objects.values('doctor_id'))
+            .order_by('id')
+            .first()
+        )
+        if self.doctor is None:
+            raise RuntimeError('No doctor with slots found; run seed_benchmark_data first.')
+
+        self.client_user = (
+            Appointment.objects.exclude(client_id=None).values_list('client_id', flat=True).first()
+        )
+
+    def client_for(self, user_id):
+        from django.contrib.auth.models import User
+
+        client = TestClient()
+        client.force_login(User.objects.get(id=user_id))
+        return client
+
+    def free_bookings(self, count):
+        # (slot, date) pairs of the benchmark doctor inside the horizon that overlap no appointment yet,
+        # nor each other, so every one of them can really be booked
+        today = datetime.today().date()
+        dates = [today + timedelta(days=i) for i in range(1, booking_horizon())]
+        claimed = {}
+        for date, start_time, end_time in Appointment.objects.filter(
+            doctor_id=self.doctor.id, start_date__in=dates
+        ).values_list('start_date', 'start_time', 'end_time'):
+            claimed.setdefault(date, []).append((start_time, end_time))
+        slots = list(Slot.objects.filter(doctor_id=self.doctor.id).order_by('start_time'))
+
+        free = []
+        for date in dates:
+            taken = claimed.get(date, [])
+            for slot in slots:
+                if slot.day != date.strftime('%A'):
+                    continue
+                if any(start < slot.end_time and end > slot.start_time for start, end in taken):
+                    continue
+                free.append((slot, date))
+                taken.append((slot.start_time, slot.end_time))
+                if len(free) >= count:
+                    return free
+        return free
+
+    def free_series(self, count, weeks):
+        # Free (slot, date) pairs whose slot is also free on the same weekday for the following weeks
+        series = []
+        for slot, date in self.free_bookings(count * 10):
+            later_dates = [date + timedelta(weeks=week) for week in range(1, weeks)]
+            if not Appointment.objects.filter(
+                doctor_id=self.doctor.id,
+                start_date__in=later_dates,
+                start_time__lt=slot.end_time,
+                end_time__gt=slot.start_time,
+            ).exists():
+                series.append((slot, date))
+                if len(series) >= count:
+                    break
+        return series
+
+
+def booking_form(context, slot, date):
+    return {
+        'doctor_id': context.doctor.id,
+        'start_date': date.strftime('%Y-%m-%d'),
+        'start_time': slot.start_time.strftime('%H:%M'),
+        'end_time': slot.end_time.strftime('%H:%M'),
+        'clinic': context.doctor.clinic_hospital or 'Clinic',
+        'one_time': 'on',
+    }
+
+
+def series_form(context, slot, date, weeks):
+    # Weekly on the same slot; an unchecked one_time checkbox is simply not sent
+    form = booking_form(context, slot, date)
+    del form['one_time']
+    form.update({
+        'repeat_every': '1',
+        'repeat_unit': 'week',
+        'end_date': (date + timedelta(weeks=weeks - 1)).strftime('%Y-%m-%d'),
+    })
+    return form
+
+
+def view_scenarios(context, iterations, series_weeks=4):
+    anonymous = TestClient()
+    doctor_client = context.client_for(context.doctor.user_id)
+    patient = context.client_for(context.client_user) if context.client_user else doctor_client
+
+    # The slot endpoints are only meaningful on a doctor with a full week (seeded with 500 slots by default)
+    weekly_slots = Slot.objects.filter(doctor_id=context.doctor.id).count()
+
+    def uncached(url_name, **kwargs):
+        # The availability engine itself: drop the cached payload before every request
+        def request():
+            invalidate_availability(context.doctor.id)
+            return patient.get(reverse(url_name, kwargs=kwargs))
+        return request
+
+    scenarios = {
+        'home': lambda: anonymous.get(reverse('home')),
+        'specialty_details': lambda: anonymous.get(
+            reverse('specialty_details', kwargs={'specialty_name': context.doctor.specialization})
+        ),
+        'fetch_slots_for_two_weeks': lambda: patient.get(
+            reverse('fetch_slots_for_two_weeks', kwargs={'doctor_username': context.doctor.user.username})
+        ),
+        'fetch_slots_for_two_weeks_by_id': lambda: patient.get(
+            reverse('fetch_slots_for_two_weeks_by_id', kwargs={'doctor_id': context.doctor.id})
+        ),
+        'fetch_slots_for_two_weeks_uncached': uncached(
+            'fetch_slots_for_two_weeks', doctor_username=context.doctor.user.username
+        ),
+        'fetch_slots_for_two_weeks_by_id_uncached': uncached(
+            'fetch_slots_for_two_weeks_by_id', doctor_id=context.doctor.id
+        ),
+        'doctor_appointments': lambda: doctor_client.get(reverse('doctor_appointments')),
+        'generate_and_save_slots': lambda: doctor_client.post(
+            reverse('generate_and_save_slots'),
+            data=json.dumps({'appointment_duration': 15}),
+            content_type='application/json',
+        ),
+    }
+
+    results = {}
+    for name, request in scenarios.items():
+        try:
+            results[name] = measure(request, iterations)
+        except NoReverseMatch:
+            results[name] = {'skipped': 'URL not configured'}
+
+    # Every booking needs a free slot, so this one walks through distinct (slot, date) pairs
+    free = context.free_bookings(iterations)
+    try:
+        url = reverse('book_appointment')
+    except NoReverseMatch:
+        results['book_appointment'] = {'skipped': 'URL not configured'}
+    else:
+        if free:
+            bookings = iter(free)
+            results['book_appointment'] = measure(
+                lambda: patient.post(url, data=booking_form(context, *next(bookings))),
+                len(free),
+            )
+        else:
+            results['book_appointment'] = {'skipped': 'no free slots'}
+
+        # The recurring path claims a whole series in one request
+        series = context.free_series(iterations, series_weeks)
+        if series:
+            starts = iter(series)
+            results['book_appointment_recurring'] = measure(
+                lambda: patient.post(url, data=series_form(context, *next(starts), series_weeks)),
+                len(series),
+            )
+        else:
+            results['book_appointment_recurring'] = {'skipped': 'no free weekly series'}
+
+    for name, result in results.items():
+        if name.startswith('fetch_slots') and 'skipped' not in result:
+            result['weekly_slots'] = weekly_slots
+
+    return results
+
+
+def booking_contention(context, threads):
+    # Many patients book the same slot and date at once; exactly one of them may win
+    free = context.free_bookings(1)
+    if not free:
+        return {'skipped': 'no free slots'}
+    slot, date = free[0]
+    url = reverse('book_appointment')
+    form = booking_form(context, slot, date)
+    client_user = context.client_user or context.doctor.user_id
+
+    barrier = threading.Barrier(threads)
+    statuses = []
+    lock = threading.Lock()
+
+    def book():
+        client = context.client_for(client_user)
+        barrier.wait()
+        status = client.post(url, data=form).status_code
+        with lock:
+            statuses.append(status)
+        connections.close_all()
+
+    workers = [threading.Thread(target=book) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    winners = Appointment.objects.filter(
+        doctor_id=context.doctor.id, start_date=date, start_time=slot.start_time
+    ).count()
+
+    return {
+        'threads': threads,
+        'winners': winners,
+        'exactly_one_winner': winners == 1,
+        'requests_per_second': round(threads / elapsed, 1),
+        'statuses': sorted(set(statuses)),
+    }
+
+
+def export_throughput(context, export_format='csv'):
+    # Rows/sec and memory of a full export; tracemalloc shows whether Python memory stays flat
+    client = context.client_for(context.doctor.user_id)
+    try:
+        url = reverse('export_appointments')
+    except NoReverseMatch:
+        return {'skipped': 'URL not configured'}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(url, {'format': export_format})
+    rows = 0
+    for chunk in response.streaming_content:
+        rows += chunk.count(b'\n')
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'rows': rows,
+        'rows_per_second': round(rows / elapsed, 1) if elapsed else None,
+        'python_peak_mb': round(peak / 1024 / 1024, 2),
+        'process_max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+    }
+
+
+def async_view_urls(context):
+    # (sync URL, async URL) pairs of the JSON slot endpoints
+    pairs = {}
+    for name, kwargs in (
+        ('get_slots', {}),
+        ('check_slots', {}),
+        ('fetch_slots_for_two_weeks', {'doctor_username': context.doctor.user.username}),
+        ('fetch_slots_for_two_weeks_by_id', {'doctor_id': context.doctor.id}),
+    ):
+        try:
+            pairs[name] = (reverse(name, kwargs=kwargs), reverse(f'{name}_async', kwargs=kwargs))
+        except NoReverseMatch:
+            pass
+    return pairs
+
+
+def sync_load(context, url, workers, requests):
+    # workers threads, each with its own client and database connection, share the requests
+    per_worker = max(requests // workers, 1)
+    statuses = []
+    lock = threading.Lock()
+
+    def run(client):
+        for _ in range(per_worker):
+            status = client.get(url).status_code
+            with lock:
+                statuses.append(status)
+        connections.close_all()
+
+    clients = [context.client_for(context.doctor.user_id) for _ in range(workers)]
+    threads = [threading.Thread(target=run, args=(client,)) for client in clients]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return statuses, elapsed, peak
+
+
+def async_load(context, url, workers, requests):
+    # The same number of requests in flight at once, on one event loop
+    from django.contrib.auth.models import User
+
+    client = AsyncClient()
+    client.force_login(User.objects.get(id=context.doctor.user_id))
+    total = max(requests // workers, 1) * workers
+
+    async def run():
+        limit = asyncio.Semaphore(workers)
+
+        async def one():
+            async with limit:
+                return (await client.get(url)).status_code
+
+        return await asyncio.gather(*(one() for _ in range(total)))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    statuses = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return statuses, elapsed, peak
+
+
+def async_comparison(context, workers=50, requests=500):
+    # Throughput and Python memory of the sync and async slot endpoints at the same concurrency
+    results = {}
+    for name, (sync_url, async_url) in async_view_urls(context).items():
+        results[name] = {}
+        for mode, load, url in (('sync', sync_load, sync_url), ('async', async_load, async_url)):
+            statuses, elapsed, peak = load(context, url, workers, requests)
+            results[name][mode] = {
+                'requests': len(statuses),
+                'requests_per_second': round(len(statuses) / elapsed, 1) if elapsed else None,
+                'python_peak_mb': round(peak / 1024 / 1024, 2),
+                'statuses': sorted(set(statuses)),
+            }
+
+    return results or {'skipped': 'URLs not configured'}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def legacy_save_slot_grid(doctor, grid):
+    # The per-slot get_or_create loop generate_and_save_slots ran before the set-based engine; the baseline
+    missing = []
+    for day, start_time, end_time in grid:
+        _, created = Slot.objects.get_or_create(
+            doctor=doctor,
+            day=day,
+            start_time=start_time,
+            end_time=end_time,
+            defaults={'reserved': False}
+        )
+        if created:
+            missing.append((day, start_time, end_time))
+    return missing
+
+
+def _time_slot_generation(doctor, grid, engine, existing):
+    # One run inside a transaction that is rolled back, so both engines see exactly the same starting rows
+    result = {}
+    try:
+        with transaction.atomic():
+            Slot.objects.filter(doctor=doctor).delete()
+            if existing:
+                save_slot_grid(doctor, grid)
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                created = engine(doctor, grid)
+                elapsed = time.perf_counter() - start
+
+            result = {'created': len(created), 'queries': len(queries), 'ms': round(elapsed * 1000, 3)}
+            raise _Rollback
+    except _Rollback:
+        pass
+    return result
+
+
+def slot_generation_comparison(context, durations=(10, 15, 30)):
+    # Before/after of generate_and_save_slots on the same doctor: a first generation and a regeneration
+    availability = doctor_availability(context.doctor)
+    results = {}
+
+    for duration in durations:
+        grid = build_slot_grid(availability, duration)
+        results[f'{duration}min'] = {
+            'slots': len(grid),
+            **{
+                f'{engine_name}_{state}': _time_slot_generation(context.doctor, grid, engine, existing)
+                for engine_name, engine in (('before', legacy_save_slot_grid), ('after', save_slot_grid))
+                for state, existing in (('empty', False), ('regenerate', True))
+            }
+        }
+
+    return results
+
+
+def run_benchmarks(iterations=20, threads=50):
+    context = BenchmarkContext()
+
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'database': connection.vendor,
+        'iterations': iterations,
+        'views': view_scenarios(context, iterations),
+        'booking_contention': booking_contention(context, threads),
+        'export_csv': export_throughput(context, 'csv'),
+        'export_ndjson': export_throughput(context, 'ndjson'),
+        'slot_generation': slot_generation_comparison(context),
+        'async_views': async_comparison(context, workers=threads),
+    }
+
+
+def compare_runs(baseline, current, tolerance=0.2):
+    # Regressions: more failed requests, p95 slower than the baseline by more than the tolerance, or more queries
+    regressions = []
+    for name, result in current.get('views', {}).items():
+        before = baseline.get('views', {}).get(name)
+        if not before:
+            continue
+
+        if result.get('failures', 0) > before.get('failures', 0):
+            regressions.append(f"{name}: failures {before.get('failures', 0)} -> {result['failures']}")
+        if 'p95_ms' not in before or 'p95_ms' not in result:
+            continue
+
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {result['queries']}")
+
+    return regressions
@@ -0,0 +1,28 @@
+import time
+
+
+def cache_version(cache, key):
+    # A version counter is part of other cache keys: bumping it orphans every entry built on the old value
+    # at once, without having to know which entries exist
+    version = cache.get(key)
+    if version is None:
+        # Start from a timestamp so a version key that was evicted never comes back with an old value
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def acache_version(cache, key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_cache_version(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted: a fresh timestamp is newer than any value it had
+        cache_version(cache, key)
@@ -0,0 +1,126 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, get_random_string
+
+from .models import Appointment
+from .models import Doctor
+
+# RFC 5545 3.1: content lines are at most 75 octets, excluding the line break
+MAX_LINE_OCTETS = 75
+
+
+class CalendarFeedKey(models.Model):
+    # Per-user secret carried in the feed URL; rotating it revokes every link handed out before
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='calendar_feed_key')
+    nonce = models.CharField(max_length=32)
+    rotated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} rotated at {self.rotated_at}"
+
+
+def feed_nonce(user, rotate=False):
+    key, created = CalendarFeedKey.objects.get_or_create(user=user, defaults={'nonce': get_random_string(32)})
+    if rotate and not created:
+        key.nonce = get_random_string(32)
+        key.save(update_fields=['nonce', 'rotated_at'])
+    return key.nonce
+
+
+def feed_filters(user_id, nonce):
+    # Appointment filters of the feed owner, or None when the nonce is not the user's current one
+    current = CalendarFeedKey.objects.filter(user_id=user_id).values_list('nonce', flat=True).first()
+    if current is None or not constant_time_compare(current, nonce):
+        return None
+
+    doctor_id = Doctor.objects.filter(user_id=user_id).values_list('id', flat=True).first()
+    if doctor_id is not None:
+        return {'doctor_id': doctor_id}
+    return {'client_id': user_id}
+
+
+def feed_appointments(filters):
+    # Recent history plus everything upcoming
+    since = datetime.today().date() - timedelta(days=getattr(settings, 'CALENDAR_FEED_PAST_DAYS', 90))
+    return Appointment.objects.filter(start_date__gte=since, **filters), since
+
+
+def feed_etag(appointments, since):
+    # Cheap fingerprint of the feed: one aggregate over the indexed doctor/client rows.
+    # New rows move the max id and the count, deletions move the count, confirmations the confirmed count.
+    state = appointments.aggregate(
+        total=Count('id'),
+        last_id=Max('id'),
+        confirmed=Count('id', filter=Q(status=True)),
+    )
+    fingerprint = f"{since}:{state['total']}:{state['last_id']}:{state['confirmed']}"
+    return '"' + hashlib.sha1(fingerprint.encode()).hexdigest() + '"'
+
+
+def escape_text(value):
+    return (
+        str(value or '')
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\n', '\\n')
+    )
+
+
+def fold(line):
+    # Longer lines continue on the next one after a CRLF and a space; characters are never split
+    if len(line.encode()) <= MAX_LINE_OCTETS:
+        return line + '\r\n'
+
+    parts = []
+    current = ''
+    size = 0
+    limit = MAX_LINE_OCTETS
+    for char in line:
+        char_size = len(char.encode())
+        if size + char_size > limit:
+            parts.append(current)
+            # The leading space of a continuation line counts towards its 75 octets
+            current, size, limit = '', 0, MAX_LINE_OCTETS - 1
+        current += char
+        size += char_size
+    parts.append(current)
+
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ical_lines(appointments, calendar_name, host):
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%SZ')
+
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield 'VERSION:2.0\r\n'
+    yield 'PRODID:-//Doctor Appointments//Schedule//EN\r\n'
+    yield fold(f'X-WR-CALNAME:{escape_text(calendar_name)}')
+
+    rows = appointments.order_by('start_date', 'start_time').values_list(
+        'id', 'start_date', 'start_time', 'end_time', 'status',
+        'doctor_name', 'doctor_clinic', 'doctor_address', 'client_name',
+    ).iterator(chunk_size=1000)
+
+    for appointment_id, start_date, start_time, end_time, status, doctor_name, clinic, address, client_name in rows:
+        start = datetime.combine(start_date, start_time)
+        end = datetime.combine(start_date, end_time)
+        yield ''.join(fold(line) for line in (
+            'BEGIN:VEVENT',
+            f'UID:appointment-{appointment_id}@{host}',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{start:%Y%m%dT%H%M%S}',
+            f'DTEND:{end:%Y%m%dT%H%M%S}',
+            f'SUMMARY:{escape_text(f"{doctor_name} - {client_name}")}',
+            f'LOCATION:{escape_text(f"{clinic}, {address}")}',
+            f'STATUS:{"CONFIRMED" if status else "TENTATIVE"}',
+            'END:VEVENT',
+        ))
+
+    yield 'END:VCALENDAR\r\n'
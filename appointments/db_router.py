@@ -0,0 +1,154 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Example with two local SQLite files; in tests the replica mirrors the primary:
+#
+#   DATABASES = {
+#       'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'primary.sqlite3'},
+#       'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica.sqlite3',
+#                   'TEST': {'MIRROR': 'default'}},
+#   }
+#   DATABASE_REPLICAS = ['replica']
+#   DATABASE_ROUTERS = ['appointments.db_router.ReplicaRouter']
+#   MIDDLEWARE = ['appointments.db_router.PrimaryStickinessMiddleware', ...]
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+STICKY_COOKIE = 'primary_until'
+STICKY_SALT = 'appointments.primary-stickiness'
+
+
+class RoutingState:
+    # Per request (or task): pinned reads always go to the primary, wrote is set by the first write
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar('replica_routing', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+
+def current_state():
+    state = _state.get()
+    if state is None:
+        # Outside a request scope (shell, management commands) the state lives for the whole context
+        state = RoutingState()
+        _state.set(state)
+    return state
+
+
+def reset_routing(*args, **kwargs):
+    # Fresh state for long-lived workers, so one task's writes don't pin the next task to the primary
+    _state.set(RoutingState())
+
+
+@contextmanager
+def routing_scope(pinned=False):
+    token = _state.set(RoutingState(pinned))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    # Reads inside the block go to the primary, e.g. when the result is cached and shared with everyone
+    state = current_state()
+    pinned = state.pinned
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = pinned
+
+
+class ReplicaRouter:
+    # Reads go to a random replica unless the request wrote, is pinned, or runs inside a transaction
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if not replicas:
+            return PRIMARY
+
+        state = _state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return PRIMARY
+
+        if connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        current_state().wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in replica_aliases()
+
+
+class PrimaryStickinessMiddleware:
+    # Keeps a visitor on the primary for a short window after they wrote, so they never read their own
+    # booking or slot change from a lagging replica. Goes first in MIDDLEWARE so session writes count too.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with routing_scope(self.is_pinned(request)) as state:
+            response = self.get_response(request)
+
+        return self.stick(state, response)
+
+    async def __acall__(self, request):
+        with routing_scope(self.is_pinned(request)) as state:
+            response = await self.get_response(request)
+
+        return self.stick(state, response)
+
+    def is_pinned(self, request):
+        sticky_until = request.get_signed_cookie(STICKY_COOKIE, default=None, salt=STICKY_SALT)
+        try:
+            return sticky_until is not None and float(sticky_until) > time.time()
+        except ValueError:
+            return False
+
+    def stick(self, state, response):
+        if state.wrote:
+            window = sticky_seconds()
+            response.set_signed_cookie(
+                STICKY_COOKIE,
+                str(time.time() + window),
+                salt=STICKY_SALT,
+                max_age=window,
+                httponly=True,
+                samesite='Lax',
+            )
+
+        return response
@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import Appointment
+
+
+def confirmation_max_age():
+    # Seconds a confirmation link is valid; an unconfirmed appointment holds its slot for the same time
+    return getattr(settings, 'APPOINTMENT_CONFIRMATION_MAX_AGE', 3600)
+
+
+class AppointmentHold(models.Model):
+    # One row per appointment waiting for its confirmation link to be clicked
+    appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, related_name='hold')
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.appointment_id} until {self.expires_at}"
+
+
+def hold_for_confirmation(appointments):
+    expires_at = timezone.now() + timedelta(seconds=confirmation_max_age())
+    AppointmentHold.objects.bulk_create([
+        AppointmentHold(appointment_id=appointment.id, expires_at=expires_at)
+        for appointment in appointments
+    ])
+
+
+def backfill_holds(batch_size=None):
+    # Unconfirmed appointments created before holds existed have none, so the sweep would never expire
+    # them. Their links were sent at an unknown time: each gets a full confirmation window from now.
+    batch_size = batch_size or getattr(settings, 'EXPIRY_SWEEP_BATCH_SIZE', 200)
+    created = 0
+
+    while True:
+        appointment_ids = list(
+            Appointment.objects.filter(status=False, hold__isnull=True)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not appointment_ids:
+            return created
+
+        expires_at = timezone.now() + timedelta(seconds=confirmation_max_age())
+        AppointmentHold.objects.bulk_create(
+            [AppointmentHold(appointment_id=appointment_id, expires_at=expires_at) for appointment_id in appointment_ids],
+            ignore_conflicts=True,
+        )
+        created += len(appointment_ids)
+
+
+def release_holds(appointment_ids):
+    AppointmentHold.objects.filter(appointment_id__in=appointment_ids).delete()
+
+
+def sweep_expired_holds(batch_size=None, max_batches=None):
+    # Delete unconfirmed appointments whose link expired, freeing their slots, in bounded batches
+    from .availability import invalidate_availability
+
+    batch_size = batch_size or getattr(settings, 'EXPIRY_SWEEP_BATCH_SIZE', 200)
+    max_batches = max_batches or getattr(settings, 'EXPIRY_SWEEP_MAX_BATCHES', 50)
+    current_time = timezone.now()
+    processed = 0
+
+    for _ in range(max_batches):
+        with transaction.atomic():
+            appointment_ids = list(
+                AppointmentHold.objects.filter(expires_at__lte=current_time)
+                .order_by('expires_at')
+                .values_list('appointment_id', flat=True)[:batch_size]
+            )
+            if not appointment_ids:
+                break
+
+            expired = Appointment.objects.filter(id__in=appointment_ids, status=False)
+            doctor_ids = set(expired.values_list('doctor_id', flat=True))
+            expired.delete()
+
+            # Holds of appointments confirmed in the meantime are just dropped
+            release_holds(appointment_ids)
+
+        for doctor_id in doctor_ids:
+            invalidate_availability(doctor_id)
+
+        processed += len(appointment_ids)
+
+    return processed
@@ -0,0 +1,51 @@
+import csv
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Appointment
+
+EXPORT_FIELDS = [
+    'id',
+    'doctor_id',
+    'doctor_name',
+    'doctor_clinic',
+    'client_id',
+    'client_name',
+    'start_date',
+    'start_time',
+    'end_time',
+    'duration',
+    'status',
+    'one_time_only',
+]
+
+
+class Echo:
+    # csv.writer only needs write(); returning the line lets the generator yield it straight away
+    def write(self, value):
+        return value
+
+
+def export_rows(filters):
+    # Rows as tuples, fetched in chunks so memory stays flat however large the export is
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    return (
+        Appointment.objects.filter(**filters)
+        .order_by('start_date', 'start_time', 'id')
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
@@ -0,0 +1,138 @@
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from PIL import Image, ImageOps
+
+# Variant name -> (width, height, crop). Cropped variants are cut to the exact box, the others only shrink.
+IMAGE_VARIANTS = getattr(settings, 'IMAGE_VARIANTS', {
+    'avatar': (96, 96, True),
+    'card': (320, 240, True),
+    'full': (1280, 1280, False),
+})
+IMAGE_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+class ImageVariant(models.Model):
+    # Thumbnails are keyed by the content hash, so identical uploads share the same files
+    content_hash = models.CharField(max_length=64)
+    variant = models.CharField(max_length=20)
+    format = models.CharField(max_length=10)
+    name = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'variant', 'format'], name='unique_image_variant'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+def content_hash_of(name):
+    # Stored originals are named <prefix>/<hash[:2]>/<hash><ext>
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def store_upload(uploaded_file, prefix):
+    # Hash the upload chunk by chunk, then store it once under its hash; re-uploads reuse the stored file
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    name = f'uploads/{prefix}/{content_hash[:2]}/{content_hash}{extension}'
+
+    if not default_storage.exists(name):
+        uploaded_file.seek(0)
+        name = default_storage.save(name, uploaded_file)
+
+    return name
+
+
+def queue_thumbnails(name):
+    from .tasks import generate_thumbnails
+    transaction.on_commit(lambda: generate_thumbnails.delay(name))
+
+
+def _resize(image, width, height, crop):
+    if crop:
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+    image = image.copy()
+    image.thumbnail((width, height), Image.LANCZOS)
+    return image
+
+
+def build_variants(name):
+    content_hash = content_hash_of(name)
+    done = set(
+        ImageVariant.objects.filter(content_hash=content_hash).values_list('variant', 'format')
+    )
+
+    with default_storage.open(name, 'rb') as original:
+        source = ImageOps.exif_transpose(Image.open(original))
+        source = source.convert('RGB')
+
+    variants = []
+    for variant, (width, height, crop) in IMAGE_VARIANTS.items():
+        resized = _resize(source, width, height, crop)
+
+        for extension, (pil_format, _) in IMAGE_FORMATS.items():
+            if (variant, extension) in done:
+                continue
+
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, quality=getattr(settings, 'IMAGE_VARIANT_QUALITY', 82))
+
+            variant_name = default_storage.save(
+                f'thumbnails/{content_hash[:2]}/{content_hash}/{variant}.{extension}',
+                ContentFile(buffer.getvalue()),
+            )
+            variants.append(ImageVariant(
+                content_hash=content_hash,
+                variant=variant,
+                format=extension,
+                name=variant_name,
+                width=resized.width,
+                height=resized.height,
+                size=buffer.tell(),
+            ))
+
+    ImageVariant.objects.bulk_create(variants, ignore_conflicts=True)
+    cache.delete(f'image-variants:{content_hash}')
+    return len(variants)
+
+
+def image_variant_urls(name):
+    # {'avatar': {'webp': url, 'jpeg': url}, ...} for a stored original; empty until the task has run.
+    # Listing pages call this once per row, so the lookup is served from the cache.
+    if not name:
+        return {}
+
+    content_hash = content_hash_of(str(name))
+    urls = cache.get(f'image-variants:{content_hash}')
+    if urls is not None:
+        return urls
+
+    urls = {}
+    for variant, extension, variant_name in ImageVariant.objects.filter(
+        content_hash=content_hash
+    ).values_list('variant', 'format', 'name'):
+        urls.setdefault(variant, {})[extension] = default_storage.url(variant_name)
+
+    # Don't remember "no thumbnails yet" for long, the task is probably still running
+    cache.set(f'image-variants:{content_hash}', urls, timeout=None if urls else 30)
+    return urls
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from appointments.expiry import backfill_holds
+
+
+class Command(BaseCommand):
+    help = 'Give unconfirmed appointments created before confirmation holds existed a hold, so they can expire'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = backfill_holds(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Created holds for {count} unconfirmed appointments.'))
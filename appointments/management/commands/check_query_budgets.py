@@ -0,0 +1,75 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from appointments.availability import invalidate_availability
+from appointments.benchmarks import BenchmarkContext, view_scenarios
+from appointments.page_cache import invalidate_public_pages
+from appointments.query_budget import check_budget, observe_budgets, QUERY_BUDGETS
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed growing amounts of synthetic data and check each view against its query budget. '
+        'Adds rows to the configured database, so point it at a throwaway one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Doctors seeded at each step')
+        parser.add_argument('--iterations', type=int, default=2)
+
+    def handle(self, *args, **options):
+        failures = []
+        previous = {}
+        seeded = 0
+
+        for size in sorted(options['sizes']):
+            if size > seeded:
+                extra = size - seeded
+                call_command(
+                    'seed_benchmark_data',
+                    doctors=extra,
+                    clients=extra * 5,
+                    appointments=extra * 50,
+                    comments=extra * 10,
+                    seed=size,
+                    stdout=StringIO(),
+                )
+                seeded = size
+
+            # Start every step from cold caches so the first request of each view hits the database
+            context = BenchmarkContext()
+            invalidate_public_pages()
+            invalidate_availability(context.doctor.id)
+
+            # The decorator would stop at the first overrun; here every view is measured and reported.
+            # Counts come from the decorator itself, so they cover the same view body its budget does.
+            with override_settings(QUERY_BUDGET_MODE=None), observe_budgets() as observed:
+                results = view_scenarios(context, options['iterations'])
+
+            self.stdout.write(f'{size} doctors:')
+            for name, result in sorted(results.items()):
+                if result.get('skipped'):
+                    self.stdout.write(f'  scenario {name}: {result["skipped"]}')
+                elif result.get('failures'):
+                    # A failing request says nothing about the queries of a successful one
+                    failures.append(f'{size} doctors: scenario {name} got statuses {result["statuses"]}')
+
+            for name, queries in sorted(observed.items()):
+                self.stdout.write(f'  {name}: {queries} queries (budget {QUERY_BUDGETS.get(name, "-")})')
+
+                message = check_budget(name, queries)
+                if message:
+                    failures.append(f'{size} doctors: {message}')
+
+                # Per-row queries show up as growth with the data size, even while still under budget
+                if name in previous and queries > previous[name]:
+                    failures.append(f'{name}: {previous[name]} -> {queries} queries as data grew to {size} doctors')
+                previous[name] = queries
+
+        if failures:
+            raise CommandError('Query budget check failed:\n' + '\n'.join(failures))
+
+        self.stdout.write(self.style.SUCCESS('All views within their query budgets.'))
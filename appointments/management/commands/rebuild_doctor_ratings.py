@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from appointments.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute every doctor rating aggregate from the comments'
+
+    def handle(self, *args, **options):
+        count = rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {count} doctors.'))
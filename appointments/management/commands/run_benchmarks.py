@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from appointments.benchmarks import compare_runs, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Run the hot views against the seeded data and report latency percentiles and query counts as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--threads', type=int, default=50, help='Concurrent requests in the booking contention and sync vs async scenarios')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Baseline JSON report to check for regressions')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 slowdown, as a fraction')
+
+    def handle(self, *args, **options):
+        report = run_benchmarks(iterations=options['iterations'], threads=options['threads'])
+        output = json.dumps(report, indent=2, default=str)
+
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+            regressions = compare_runs(baseline, report, options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
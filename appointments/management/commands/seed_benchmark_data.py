@@ -0,0 +1,212 @@
+import random
+from datetime import date, datetime, time, timedelta
+from uuid import uuid4
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from appointments.models import Appointment, Client, Comment, Doctor, MedicalSpecialty, Slot
+from appointments.ratings import rebuild_ratings
+from appointments.search import rebuild_search_index
+from appointments.stats import reconcile_statistics
+
+SPECIALTY_NAMES = [
+    'Cardiology', 'Dermatology', 'Neurology', 'Pediatrics', 'Dentistry', 'General Practice',
+    'Ophthalmology', 'Orthopedics', 'Psychiatry', 'Radiology', 'Urology', 'Oncology',
+]
+FIRST_NAMES = ['Ana', 'Mihai', 'Elena', 'Andrei', 'Ioana', 'Radu', 'Maria', 'Alex', 'Irina', 'Dan']
+LAST_NAMES = ['Popescu', 'Ionescu', 'Stan', 'Dumitru', 'Georgescu', 'Matei', 'Lazar', 'Marin']
+LANGUAGES = ['English', 'Romanian', 'French', 'German', 'Spanish', 'Italian']
+WORKING_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+SLOT_WINDOW_MINUTES = 16 * 60  # 08:00 to midnight
+WEEKS_BACK = 52
+WEEKS_AHEAD = 2
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate synthetic specialties, doctors, slots, clients, appointments and comments for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--specialties', type=int, default=12)
+        parser.add_argument('--doctors', type=int, default=200)
+        parser.add_argument('--slots-per-doctor', type=int, default=500, help='Weekly slots of every doctor')
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--appointments', type=int, default=50000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.password = make_password('benchmark')
+
+        specialties = self.seed_specialties(options['specialties'])
+        doctors = self.seed_doctors(options['doctors'], specialties)
+        self.seed_slots(options['slots_per_doctor'], doctors)
+        clients = self.seed_clients(options['clients'])
+        self.seed_appointments(options['appointments'], doctors, clients, options['slots_per_doctor'])
+        self.seed_comments(options['comments'], doctors, clients)
+
+        # bulk_create skips the signals, so rebuild the derived tables once at the end
+        self.stdout.write('Rebuilding derived data...')
+        reconcile_statistics()
+        rebuild_search_index()
+        rebuild_ratings()
+
+        self.stdout.write(self.style.SUCCESS('Benchmark data seeded.'))
+
+    def bulk(self, model, objects):
+        created = 0
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
+            created += len(batch)
+
+        self.stdout.write(f'  {model.__name__}: {created}')
+        return created
+
+    def seed_users(self, prefix, count, group_name):
+        # Unique per call, so seeding twice within a second doesn't collide on usernames
+        run = uuid4().hex[:8]
+        self.bulk(User, (
+            User(
+                username=f'{prefix}-{run}-{i}',
+                email=f'{prefix}-{run}-{i}@example.com',
+                password=self.password,
+                first_name=self.random.choice(FIRST_NAMES),
+                last_name=self.random.choice(LAST_NAMES),
+            )
+            for i in range(count)
+        ))
+
+        user_ids = list(
+            User.objects.filter(username__startswith=f'{prefix}-{run}-').order_by('id').values_list('id', flat=True)
+        )
+        group, _ = Group.objects.get_or_create(name=group_name)
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=user_id, group_id=group.id) for user_id in user_ids],
+            batch_size=self.batch_size,
+        )
+        return user_ids
+
+    def seed_specialties(self, count):
+        names = [
+            SPECIALTY_NAMES[i] if i < len(SPECIALTY_NAMES) else f'Specialty {i}'
+            for i in range(count)
+        ]
+        existing = set(MedicalSpecialty.objects.filter(name__in=names).values_list('name', flat=True))
+        self.bulk(MedicalSpecialty, (MedicalSpecialty(name=name) for name in names if name not in existing))
+        return names
+
+    def seed_doctors(self, count, specialties):
+        user_ids = self.seed_users('bench-doctor', count, 'Doctor')
+        self.bulk(Doctor, (
+            Doctor(
+                user_id=user_id,
+                specialization=self.random.choice(specialties),
+                gender=self.random.choice(['male', 'female']),
+                experience=self.random.randint(1, 40),
+                consultation_fee=self.random.choice([None, self.random.randint(100, 2000)]),
+                clinic_hospital=f'Clinic {self.random.randint(1, max(count // 10, 1))}',
+                address=f'{self.random.randint(1, 200)} Main Street',
+                contact=f'07{self.random.randint(10000000, 99999999)}',
+                services='Consultations, check-ups, follow-ups',
+                languages_spoken=', '.join(self.random.sample(LANGUAGES, 2)),
+                **{
+                    f'{day.lower()}_{edge}': value
+                    for day in WORKING_DAYS
+                    for edge, value in (('start', '08:00'), ('end', '18:00'))
+                }
+            )
+            for user_id in user_ids
+        ))
+        return list(Doctor.objects.filter(user_id__in=user_ids).order_by('id').values_list('id', flat=True))
+
+    def seed_slots(self, per_doctor, doctor_ids):
+        # Slots from 08:00 spread evenly over the working days; shorter than ten minutes when that's needed
+        # to fit them all before midnight. Generated doctor by doctor straight into the batches: slot n of a
+        # doctor is fully determined by n, so seed_appointments recomputes it instead of keeping a list.
+        per_day = -(-per_doctor // len(WORKING_DAYS))
+        self.slot_minutes = min(10, SLOT_WINDOW_MINUTES // max(per_day, 1))
+        if self.slot_minutes < 1:
+            raise CommandError(f'At most {SLOT_WINDOW_MINUTES * len(WORKING_DAYS)} slots fit in a doctor\'s week.')
+
+        self.bulk(Slot, (
+            Slot(doctor_id=doctor_id, day=day, start_time=start_time, end_time=end_time, reserved=False)
+            for doctor_id in doctor_ids
+            for day, start_time, end_time in map(self.weekly_slot, range(per_doctor))
+        ))
+
+    def weekly_slot(self, n):
+        day = WORKING_DAYS[n % len(WORKING_DAYS)]
+        start = datetime.combine(date.today(), time(8, 0)) + timedelta(minutes=self.slot_minutes * (n // len(WORKING_DAYS)))
+        end = start + timedelta(minutes=self.slot_minutes)
+        return day, start.time(), end.time()
+
+    def seed_clients(self, count):
+        user_ids = self.seed_users('bench-client', count, 'Client')
+        self.bulk(Client, (
+            Client(
+                user_id=user_id,
+                gender=self.random.choice(['male', 'female']),
+                contact=f'07{self.random.randint(10000000, 99999999)}',
+                address=f'{self.random.randint(1, 200)} Side Street',
+            )
+            for user_id in user_ids
+        ))
+        return user_ids
+
+    def seed_appointments(self, count, doctor_ids, client_ids, per_doctor):
+        # Spread over the past year and the next two weeks. Every (doctor, slot, week) is drawn at most once,
+        # so no slot is booked twice on the same date.
+        weeks = WEEKS_BACK + 1 + WEEKS_AHEAD
+        per_doctor_weeks = per_doctor * weeks
+        available = len(doctor_ids) * per_doctor_weeks
+        if count > available:
+            raise CommandError(f'At most {available} appointments fit in the seeded slots.')
+
+        today = date.today()
+        first_monday = today - timedelta(days=today.weekday(), weeks=WEEKS_BACK)
+
+        def generate():
+            # sample() over a range draws without replacement and without materializing the range
+            for draw in self.random.sample(range(available), count):
+                doctor_index, rest = divmod(draw, per_doctor_weeks)
+                n, week = divmod(rest, weeks)
+                day, start_time, end_time = self.weekly_slot(n)
+                yield Appointment(
+                    doctor_id=doctor_ids[doctor_index],
+                    doctor_name='Dr. Benchmark',
+                    doctor_clinic='Benchmark Clinic',
+                    start_date=first_monday + timedelta(days=WORKING_DAYS.index(day), weeks=week),
+                    start_time=start_time,
+                    end_time=end_time,
+                    duration=self.slot_minutes,
+                    status=self.random.random() < 0.9,
+                    one_time_only=True,
+                    client_id=self.random.choice(client_ids),
+                    client_name='Benchmark Client',
+                )
+
+        with transaction.atomic():
+            self.bulk(Appointment, generate())
+
+    def seed_comments(self, count, doctor_ids, client_ids):
+        self.bulk(Comment, (
+            Comment(
+                doctor_id=self.random.choice(doctor_ids),
+                user_id=self.random.choice(client_ids),
+                rating=self.random.randint(1, 5),
+                content='Synthetic review',
+            )
+            for _ in range(count)
+        ))
@@ -0,0 +1,175 @@
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = getattr(settings, 'METRICS_LATENCY_BUCKETS', [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+
+_lock = threading.Lock()
+_views = {}
+
+
+class QueryCounter:
+    # connection.execute_wrapper hook: counts queries and the time spent in the database
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def record(view_name, latency, query_count, query_duration):
+    with _lock:
+        stats = _views.get(view_name)
+        if stats is None:
+            stats = _views[view_name] = {
+                'requests': 0,
+                'latency_sum': 0.0,
+                'buckets': [0] * len(LATENCY_BUCKETS),
+                'queries': 0,
+                'sql_seconds': 0.0,
+            }
+
+        stats['requests'] += 1
+        stats['latency_sum'] += latency
+        stats['queries'] += query_count
+        stats['sql_seconds'] += query_duration
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                stats['buckets'][index] += 1
+                break
+
+
+def snapshot():
+    with _lock:
+        return {
+            name: dict(stats, buckets=list(stats['buckets']))
+            for name, stats in _views.items()
+        }
+
+
+class ViewMetricsMiddleware:
+    # Per-view request count, latency histogram, SQL query count and SQL time, keyed by URL name
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            self.wrap_connections(stack, counter)
+            response = self.get_response(request)
+
+        self.record(request, time.perf_counter() - start, counter)
+        return response
+
+    async def __acall__(self, request):
+        # Connections are per thread, and async views run their ORM calls through sync_to_async in a
+        # thread-sensitive worker thread, not in the event loop's. The wrappers are installed and removed
+        # in that same worker thread, which Django's ASGI handler gives to one request at a time.
+        counter = QueryCounter()
+        start = time.perf_counter()
+
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+        self.record(request, time.perf_counter() - start, counter)
+        return response
+
+    def wrap_connections(self, stack, counter):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+
+    def record(self, request, latency, counter):
+        match = getattr(request, 'resolver_match', None)
+        view_name = (match.url_name or match.view_name) if match else 'unresolved'
+
+        record(view_name, latency, counter.count, counter.duration)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    from .availability import availability_cache_stats
+
+    lines = []
+    views = snapshot()
+
+    lines.append('# HELP appointments_view_requests_total Requests handled per view.')
+    lines.append('# TYPE appointments_view_requests_total counter')
+    for name, stats in sorted(views.items()):
+        lines.append(f'appointments_view_requests_total{{view="{_escape(name)}"}} {stats["requests"]}')
+
+    lines.append('# HELP appointments_view_latency_seconds Request latency per view.')
+    lines.append('# TYPE appointments_view_latency_seconds histogram')
+    for name, stats in sorted(views.items()):
+        label = _escape(name)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+            cumulative += count
+            lines.append(f'appointments_view_latency_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'appointments_view_latency_seconds_bucket{{view="{label}",le="+Inf"}} {stats["requests"]}')
+        lines.append(f'appointments_view_latency_seconds_sum{{view="{label}"}} {stats["latency_sum"]:.6f}')
+        lines.append(f'appointments_view_latency_seconds_count{{view="{label}"}} {stats["requests"]}')
+
+    lines.append('# HELP appointments_view_sql_queries_total SQL queries executed per view.')
+    lines.append('# TYPE appointments_view_sql_queries_total counter')
+    for name, stats in sorted(views.items()):
+        lines.append(f'appointments_view_sql_queries_total{{view="{_escape(name)}"}} {stats["queries"]}')
+
+    lines.append('# HELP appointments_view_sql_seconds_total Time spent in SQL per view.')
+    lines.append('# TYPE appointments_view_sql_seconds_total counter')
+    for name, stats in sorted(views.items()):
+        lines.append(f'appointments_view_sql_seconds_total{{view="{_escape(name)}"}} {stats["sql_seconds"]:.6f}')
+
+    cache_stats = availability_cache_stats()
+    lines.append('# HELP appointments_availability_cache_total Availability cache lookups by result.')
+    lines.append('# TYPE appointments_availability_cache_total counter')
+    lines.append(f'appointments_availability_cache_total{{result="hit"}} {cache_stats["hits"]}')
+    lines.append(f'appointments_availability_cache_total{{result="miss"}} {cache_stats["misses"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_token_valid(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and constant_time_compare(credentials.strip(), token)
+
+
+def metrics_view(request):
+    # Scraped by Prometheus with "Authorization: Bearer <METRICS_TOKEN>"; staff users may look too.
+    # Deliberately not gated on REMOTE_ADDR: behind a reverse proxy on the same host every request,
+    # including public ones, arrives from 127.0.0.1.
+    user = getattr(request, 'user', None)
+    if not metrics_token_valid(request) and not (user is not None and user.is_staff):
+        return HttpResponseForbidden()
+
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,137 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import models, transaction
+from django.utils import timezone
+
+
+class OutboxEmail(models.Model):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)}"
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    # The request only pays for the INSERT; the worker is kicked once the transaction commits
+    email = OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email,
+        recipients=list(recipient_list),
+    )
+
+    from .tasks import send_outbox_emails
+    transaction.on_commit(lambda: send_outbox_emails.delay())
+
+    return email
+
+
+def queue_mails(emails):
+    # Batch variant of queue_mail: emails are (subject, message, from_email, recipient_list) tuples
+    queued = OutboxEmail.objects.bulk_create([
+        OutboxEmail(subject=subject, body=message, from_email=from_email, recipients=list(recipient_list))
+        for subject, message, from_email, recipient_list in emails
+    ])
+
+    if queued:
+        from .tasks import send_outbox_emails
+        transaction.on_commit(lambda: send_outbox_emails.delay())
+
+    return queued
+
+
+def drain_outbox(batch_size=None):
+    # Send one batch of due emails over a single SMTP connection; returns (sent, failed)
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+    retry_delay = getattr(settings, 'OUTBOX_RETRY_DELAY', 60)  # Seconds, doubled after every failed attempt
+    current_time = timezone.now()
+
+    # Lease the batch so a concurrent worker skips it while we talk to the mail server
+    with transaction.atomic():
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+                sent_at__isnull=True,
+                next_attempt_at__lte=current_time,
+                attempts__lt=max_attempts,
+            ).order_by('id')[:batch_size]
+        )
+        OutboxEmail.objects.filter(id__in=[email.id for email in batch]).update(
+            next_attempt_at=current_time + timedelta(seconds=retry_delay)
+        )
+
+    if not batch:
+        return 0, 0
+
+    sent_ids = []
+    failed = []
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # The mail server is unreachable; the whole batch counts as one failed attempt
+        failed = [(email, e) for email in batch]
+    else:
+        try:
+            for email in batch:
+                message = EmailMessage(
+                    subject=email.subject,
+                    body=email.body,
+                    from_email=email.from_email,
+                    to=email.recipients,
+                    connection=connection,
+                )
+                try:
+                    connection.send_messages([message])
+                    sent_ids.append(email.id)
+                except Exception as e:
+                    failed.append((email, e))
+        finally:
+            connection.close()
+
+    # Bodies carry confirmation and password reset links; once delivered they are not kept around
+    OutboxEmail.objects.filter(id__in=sent_ids).update(sent_at=timezone.now(), body='')
+
+    for email, error in failed:
+        email.attempts += 1
+        email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay * 2 ** email.attempts)
+        email.last_error = str(error)
+        email.save(update_fields=['attempts', 'next_attempt_at', 'last_error'])
+
+    return len(sent_ids), len(failed)
+
+
+def purge_outbox(batch_size=None):
+    # Delete sent and abandoned rows once they are past the retention period, in bounded batches;
+    # abandoned rows still hold their body and stay for the same time so the failure can be looked into
+    batch_size = batch_size or getattr(settings, 'OUTBOX_PURGE_BATCH_SIZE', 1000)
+    retention = timedelta(days=getattr(settings, 'OUTBOX_RETENTION_DAYS', 7))
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+    cutoff = timezone.now() - retention
+
+    finished = OutboxEmail.objects.filter(
+        models.Q(sent_at__lte=cutoff) | models.Q(sent_at__isnull=True, attempts__gte=max_attempts, created_at__lte=cutoff)
+    )
+
+    deleted = 0
+    while True:
+        ids = list(finished.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += OutboxEmail.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,99 @@
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from .cache_versions import bump_cache_version, cache_version
+from .models import Comment
+from .models import Doctor
+from .models import MedicalSpecialty
+
+# Only these parameters change what the public pages render; everything else (utm tags, ...) is ignored
+CACHED_QUERY_KEYS = ['q', 'gender', 'experience', 'fee', 'sort', 'cursor', 'page']
+
+GENERATION_KEY = 'page-cache:generation'
+
+
+def page_cache_generation():
+    return cache_version(cache, GENERATION_KEY)
+
+
+def invalidate_public_pages(*args, **kwargs):
+    # Bumping the generation orphans every cached page at once
+    bump_cache_version(cache, GENERATION_KEY)
+
+
+def page_cache_key(request):
+    query = sorted(
+        (key, value)
+        for key in CACHED_QUERY_KEYS
+        for value in request.GET.getlist(key)
+    )
+    return f'page-cache:{page_cache_generation()}:{request.path}?{urlencode(query)}'
+
+
+def _bypass(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return True
+
+    # Pending flash messages are per visitor
+    if 'messages' in request.COOKIES:
+        return True
+    session = getattr(request, 'session', None)
+    return bool(session is not None and session.get('_messages'))
+
+
+def cache_public_page(view):
+    # Whole-response cache for anonymous visitors, with headers a CDN can honour
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if _bypass(request):
+            response = view(request, *args, **kwargs)
+            response.setdefault('Cache-Control', 'private, no-cache')
+            return response
+
+        key = page_cache_key(request)
+        cached = cache.get(key)
+
+        if cached is None:
+            response = view(request, *args, **kwargs)
+
+            # Pages that used a CSRF token or set cookies belong to one visitor only
+            per_visitor = (
+                request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or
+                request.META.get('CSRF_COOKIE_USED') or
+                response.cookies
+            )
+            if response.status_code != 200 or response.streaming or per_visitor:
+                return response
+
+            cached = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': '"' + hashlib.md5(response.content).hexdigest() + '"',
+            }
+            cache.set(key, cached, timeout=getattr(settings, 'PUBLIC_PAGE_CACHE_TIMEOUT', 300))
+
+        response = get_conditional_response(request, etag=cached['etag'])
+        if response is None:
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+
+        response['ETag'] = cached['etag']
+        response['Cache-Control'] = f"public, max-age={getattr(settings, 'PUBLIC_PAGE_MAX_AGE', 60)}"
+        response['Vary'] = 'Cookie'
+        return response
+
+    return wrapper
+
+
+def connect_signals():
+    # Called from AppointmentsConfig.ready()
+    # User is left out on purpose: every login saves last_login. Doctor name changes also save the Doctor row.
+    for public_model in (Doctor, MedicalSpecialty, Comment):
+        post_save.connect(invalidate_public_pages, sender=public_model, dispatch_uid=f'page-cache-saved-{public_model.__name__}')
+        post_delete.connect(invalidate_public_pages, sender=public_model, dispatch_uid=f'page-cache-deleted-{public_model.__name__}')
@@ -0,0 +1,71 @@
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+CURSOR_SALT = 'appointments.keyset-cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorSerializer(signing.JSONSerializer):
+    # Sort keys can be dates, times or decimals
+    def dumps(self, obj):
+        return DjangoJSONEncoder(separators=(',', ':')).encode(obj).encode('latin-1')
+
+
+def encode_cursor(values):
+    return signing.dumps(values, salt=CURSOR_SALT, serializer=CursorSerializer, compress=True)
+
+
+def decode_cursor(cursor, length):
+    # A cursor we didn't sign, or one for other sort keys, is the client's error rather than the first page
+    try:
+        values = signing.loads(cursor, salt=CURSOR_SALT, serializer=CursorSerializer)
+    except signing.BadSignature:
+        raise InvalidCursor
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor
+    return values
+
+
+def _after(keys, values):
+    # Rows strictly after the cursor in (key1, key2, ...) order, NULLs sorted last
+    condition = Q(pk__in=[])
+    equal_so_far = Q()
+
+    for (field, descending), value in zip(keys, values):
+        if value is not None:
+            lookup = f'{field}__lt' if descending else f'{field}__gt'
+            condition |= equal_so_far & (Q(**{lookup: value}) | Q(**{f'{field}__isnull': True}))
+            equal_so_far &= Q(**{field: value})
+        else:
+            equal_so_far &= Q(**{f'{field}__isnull': True})
+
+    return condition
+
+
+def keyset_page(queryset, keys, cursor=None, page_size=20):
+    # keys is a list of (field, descending); the last key has to be unique (usually 'id'). Raises
+    # InvalidCursor for a cursor that was tampered with.
+    ordering = [
+        F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+        for field, descending in keys
+    ]
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        queryset = queryset.filter(_after(keys, decode_cursor(cursor, len(keys))))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([
+            last[field] if isinstance(last, dict) else getattr(last, field)
+            for field, _ in keys
+        ])
+
+    return rows, next_cursor
@@ -0,0 +1,122 @@
+import logging
+import os
+import traceback
+from contextlib import contextmanager, ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# View name -> maximum number of SQL queries one request may run, filled in by @query_budget
+QUERY_BUDGETS = {}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# How many distinct statements to show per call site in a report
+SQL_PER_CALL_SITE = 3
+
+# Open observe_budgets() blocks, each a dict of view name -> most queries seen in one request
+_observers = []
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def budget_mode():
+    # 'raise' in tests, 'log' in debug mode, off in production unless QUERY_BUDGET_MODE says otherwise
+    return getattr(settings, 'QUERY_BUDGET_MODE', 'log' if settings.DEBUG else None)
+
+
+def call_site():
+    # Innermost frame in our own code, so template and ORM internals collapse onto the line that triggered them
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename == os.path.abspath(__file__) or 'site-packages' in filename:
+            continue
+        if filename.startswith(PROJECT_ROOT):
+            return f'{os.path.relpath(filename, PROJECT_ROOT)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class QueryRecorder:
+    # connection.execute_wrapper hook: keeps each statement with the line of our code that issued it
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((call_site(), sql))
+        return execute(sql, params, many, context)
+
+    def by_call_site(self):
+        sites = {}
+        for site, sql in self.queries:
+            statements = sites.setdefault(site, {})
+            statements[sql] = statements.get(sql, 0) + 1
+        return sorted(sites.items(), key=lambda item: -sum(item[1].values()))
+
+
+def budget_report(view_name, budget, recorder):
+    lines = [f'{view_name} ran {len(recorder.queries)} queries, budget is {budget}:']
+    for site, statements in recorder.by_call_site():
+        lines.append(f'  {sum(statements.values())}x {site}')
+        for sql, count in sorted(statements.items(), key=lambda item: -item[1])[:SQL_PER_CALL_SITE]:
+            lines.append(f'      {count}x {sql}')
+    return '\n'.join(lines)
+
+
+def check_budget(view_name, query_count, budget=None):
+    # For harnesses that count queries themselves; returns a message when the budget is exceeded
+    budget = QUERY_BUDGETS.get(view_name) if budget is None else budget
+    if budget is not None and query_count > budget:
+        return f'{view_name} ran {query_count} queries, budget is {budget}'
+    return None
+
+
+@contextmanager
+def observe_budgets():
+    # Collects what the decorator itself counts, i.e. the view body without middleware and sessions,
+    # so harnesses compare budgets against the same number the per-request check uses
+    observed = {}
+    _observers.append(observed)
+    try:
+        yield observed
+    finally:
+        _observers.remove(observed)
+
+
+def query_budget(max_queries):
+    # Declares the most SQL queries a view may run; checked per request when budget_mode() is on
+    def decorator(view):
+        QUERY_BUDGETS[view.__name__] = max_queries
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            mode = budget_mode()
+            if not mode and not _observers:
+                return view(request, *args, **kwargs)
+
+            recorder = QueryRecorder()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = view(request, *args, **kwargs)
+
+            query_count = len(recorder.queries)
+            for observed in _observers:
+                observed[view.__name__] = max(observed.get(view.__name__, 0), query_count)
+
+            if mode and query_count > max_queries:
+                report = budget_report(view.__name__, max_queries, recorder)
+                if mode == 'raise':
+                    raise QueryBudgetExceeded(report)
+                logger.error(report)
+
+            return response
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return decorator
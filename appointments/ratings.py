@@ -0,0 +1,130 @@
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.signals import post_delete, post_save
+
+from .models import Comment
+from .models import Doctor
+
+STARS = [1, 2, 3, 4, 5]
+
+HISTOGRAM_FIELDS = {
+    1: 'one_star',
+    2: 'two_stars',
+    3: 'three_stars',
+    4: 'four_stars',
+    5: 'five_stars',
+}
+
+
+class DoctorRating(models.Model):
+    # Running rating aggregates for a doctor, so profiles and listings never GROUP BY over comments
+    doctor = models.OneToOneField(Doctor, on_delete=models.CASCADE, related_name='rating_summary')
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0.0)
+    one_star = models.PositiveIntegerField(default=0)
+    two_stars = models.PositiveIntegerField(default=0)
+    three_stars = models.PositiveIntegerField(default=0)
+    four_stars = models.PositiveIntegerField(default=0)
+    five_stars = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.doctor_id}: {self.average:.2f} ({self.count})"
+
+    @property
+    def histogram(self):
+        return {star: getattr(self, HISTOGRAM_FIELDS[star]) for star in STARS}
+
+
+AVERAGE = Case(
+    When(count=0, then=0.0),
+    default=Cast(F('total'), FloatField()) / F('count'),
+    output_field=FloatField(),
+)
+
+
+def parse_rating(value):
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if rating in STARS else None
+
+
+def apply_rating(doctor_id, rating, delta):
+    # Add (delta=1) or remove (delta=-1) one rating with F-expressions, then refresh the average
+    with transaction.atomic():
+        ratings = DoctorRating.objects.filter(doctor_id=doctor_id)
+        if delta > 0:
+            DoctorRating.objects.get_or_create(doctor_id=doctor_id)
+        else:
+            # Removing never creates a row: while a doctor (or their user) is being deleted, the cascade may
+            # already have removed the summary and the doctor, and there is nothing left to update
+            ratings = ratings.filter(count__gt=0, **{f'{HISTOGRAM_FIELDS[rating]}__gt': 0})
+
+        updated = ratings.update(**{
+            'count': F('count') + delta,
+            'total': F('total') + rating * delta,
+            HISTOGRAM_FIELDS[rating]: F(HISTOGRAM_FIELDS[rating]) + delta,
+        })
+        if not updated:
+            return
+
+        DoctorRating.objects.filter(doctor_id=doctor_id).update(average=AVERAGE)
+
+        # Doctor.rating mirrors the average so listings can sort on it without a join
+        Doctor.objects.filter(pk=doctor_id).update(rating=Coalesce(
+            Subquery(DoctorRating.objects.filter(doctor_id=OuterRef('pk')).values('average')[:1]),
+            Value(0.0),
+        ))
+
+
+def rebuild_ratings():
+    # Recompute every doctor's aggregates from the comments in one GROUP BY
+    rows = Comment.objects.filter(rating__in=STARS).values('doctor_id').annotate(
+        rating_count=Count('id'),
+        rating_total=Sum('rating'),
+        **{
+            f'rating_{field}': Count('id', filter=Q(rating=star))
+            for star, field in HISTOGRAM_FIELDS.items()
+        }
+    )
+
+    with transaction.atomic():
+        DoctorRating.objects.all().delete()
+        DoctorRating.objects.bulk_create([
+            DoctorRating(
+                doctor_id=row['doctor_id'],
+                count=row['rating_count'],
+                total=row['rating_total'],
+                average=row['rating_total'] / row['rating_count'],
+                **{field: row[f'rating_{field}'] for field in HISTOGRAM_FIELDS.values()}
+            )
+            for row in rows
+        ], batch_size=1000)
+
+        Doctor.objects.update(rating=Coalesce(
+            Subquery(DoctorRating.objects.filter(doctor_id=OuterRef('pk')).values('average')[:1]),
+            Value(0.0),
+        ))
+
+    return DoctorRating.objects.count()
+
+
+def rating_added(sender, instance, created, raw=False, **kwargs):
+    rating = parse_rating(instance.rating)
+    if created and not raw and rating:
+        apply_rating(instance.doctor_id, rating, 1)
+
+
+def rating_removed(sender, instance, **kwargs):
+    rating = parse_rating(instance.rating)
+    if rating:
+        apply_rating(instance.doctor_id, rating, -1)
+
+
+def connect_signals():
+    # Called from AppointmentsConfig.ready()
+    post_save.connect(rating_added, sender=Comment, dispatch_uid='doctor-rating-added')
+    post_delete.connect(rating_removed, sender=Comment, dispatch_uid='doctor-rating-removed')
@@ -0,0 +1,194 @@
+import re
+
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.db.models import Case, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.signals import post_delete, post_save
+
+from .models import Doctor
+from .models import MedicalSpecialty
+
+DOCTOR = 'doctor'
+SPECIALTY = 'specialty'
+
+# How much a match in each field counts towards the relevance score
+DOCTOR_FIELD_WEIGHTS = {
+    'name': 3.0,
+    'specialization': 2.0,
+    'clinic_hospital': 1.5,
+    'services': 1.0,
+    'languages_spoken': 1.0,
+}
+SPECIALTY_NAME_WEIGHT = 3.0
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchTerm(models.Model):
+    # Inverted index: one row per (term, indexed object), weighted by the field the term came from
+    term = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20)
+    object_id = models.PositiveIntegerField()
+    weight = models.FloatField(default=1.0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'kind']),
+            models.Index(fields=['kind', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.kind}:{self.object_id}"
+
+
+def tokenize(text):
+    return [token[:100] for token in TOKEN_RE.findall((text or '').lower()) if len(token) > 1]
+
+
+def _weighted_terms(fields):
+    # Sum the weights of a term that appears in several fields, so each (term, object) is one row
+    weights = {}
+    for text, weight in fields:
+        for token in set(tokenize(text)):
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def _replace_terms(kind, object_id, weights):
+    with transaction.atomic():
+        SearchTerm.objects.filter(kind=kind, object_id=object_id).delete()
+        SearchTerm.objects.bulk_create([
+            SearchTerm(term=term, kind=kind, object_id=object_id, weight=weight)
+            for term, weight in weights.items()
+        ])
+
+
+def doctor_terms(doctor):
+    user = doctor.user
+    return _weighted_terms([
+        (f"{user.first_name} {user.last_name} {user.username}", DOCTOR_FIELD_WEIGHTS['name']),
+        (doctor.specialization, DOCTOR_FIELD_WEIGHTS['specialization']),
+        (doctor.clinic_hospital, DOCTOR_FIELD_WEIGHTS['clinic_hospital']),
+        (doctor.services, DOCTOR_FIELD_WEIGHTS['services']),
+        (doctor.languages_spoken, DOCTOR_FIELD_WEIGHTS['languages_spoken']),
+    ])
+
+
+def specialty_terms(specialty):
+    return _weighted_terms([(specialty.name, SPECIALTY_NAME_WEIGHT)])
+
+
+def index_doctor(doctor):
+    _replace_terms(DOCTOR, doctor.id, doctor_terms(doctor))
+
+
+def index_specialty(specialty):
+    _replace_terms(SPECIALTY, specialty.id, specialty_terms(specialty))
+
+
+def rebuild_search_index(batch_size=1000):
+    # Full rebuild, e.g. after the first deploy or a bulk import that bypassed the signals
+    with transaction.atomic():
+        SearchTerm.objects.all().delete()
+
+        terms = []
+        for doctor in Doctor.objects.select_related('user').iterator(chunk_size=batch_size):
+            terms.extend(
+                SearchTerm(term=term, kind=DOCTOR, object_id=doctor.id, weight=weight)
+                for term, weight in doctor_terms(doctor).items()
+            )
+            if len(terms) >= batch_size:
+                SearchTerm.objects.bulk_create(terms)
+                terms = []
+
+        for specialty in MedicalSpecialty.objects.iterator(chunk_size=batch_size):
+            terms.extend(
+                SearchTerm(term=term, kind=SPECIALTY, object_id=specialty.id, weight=weight)
+                for term, weight in specialty_terms(specialty).items()
+            )
+
+        SearchTerm.objects.bulk_create(terms, batch_size=batch_size)
+
+
+def search(query, kinds=(DOCTOR, SPECIALTY)):
+    # Ranked (kind, object_id, score) rows matching every word; the last word is matched as a prefix for
+    # search-as-you-type, the others must match a whole term
+    tokens = tokenize(query)
+    if not tokens:
+        return SearchTerm.objects.none().values('kind', 'object_id')
+
+    *full_tokens, last_token = tokens
+    full_tokens = list(dict.fromkeys(full_tokens))
+    token_filters = [Q(term=token) for token in full_tokens] + [Q(term__startswith=last_token)]
+
+    term_filter = Q()
+    for token_filter in token_filters:
+        term_filter |= token_filter
+
+    # One 0/1 flag per query word, so an object that matches the same word through several terms
+    # (e.g. a prefix hitting "cardio" and "cardiology") still counts it once
+    token_hits = {
+        f'token_{index}': Max(Case(When(token_filter, then=Value(1)), default=Value(0), output_field=IntegerField()))
+        for index, token_filter in enumerate(token_filters)
+    }
+
+    return (
+        SearchTerm.objects.filter(term_filter, kind__in=kinds)
+        .values('kind', 'object_id')
+        .annotate(**token_hits)
+        .annotate(matched=sum((models.F(name) for name in token_hits), Value(0)), score=Sum('weight'))
+        .filter(matched=len(token_filters))
+        .order_by('-matched', '-score', 'kind', 'object_id')
+    )
+
+
+def load_hits(rows):
+    # Resolve one page of search rows to model instances with one query per kind
+    doctor_ids = [row['object_id'] for row in rows if row['kind'] == DOCTOR]
+    specialty_ids = [row['object_id'] for row in rows if row['kind'] == SPECIALTY]
+
+    objects = {
+        DOCTOR: Doctor.objects.select_related('user').in_bulk(doctor_ids) if doctor_ids else {},
+        SPECIALTY: MedicalSpecialty.objects.in_bulk(specialty_ids) if specialty_ids else {},
+    }
+
+    return [
+        {'kind': row['kind'], 'object': objects[row['kind']][row['object_id']], 'score': row['score']}
+        for row in rows
+        if row['object_id'] in objects[row['kind']]
+    ]
+
+
+def reindex_doctor(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_doctor(instance)
+
+
+def reindex_doctor_user(sender, instance, raw=False, **kwargs):
+    # The doctor's name lives on the User row
+    if not raw and not kwargs.get('created'):
+        doctor = Doctor.objects.filter(user=instance).first()
+        if doctor:
+            index_doctor(doctor)
+
+
+def reindex_specialty(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_specialty(instance)
+
+
+def unindex_doctor(sender, instance, **kwargs):
+    SearchTerm.objects.filter(kind=DOCTOR, object_id=instance.id).delete()
+
+
+def unindex_specialty(sender, instance, **kwargs):
+    SearchTerm.objects.filter(kind=SPECIALTY, object_id=instance.id).delete()
+
+
+def connect_signals():
+    # Called from AppointmentsConfig.ready()
+    post_save.connect(reindex_doctor, sender=Doctor, dispatch_uid='search-index-doctor')
+    post_save.connect(reindex_doctor_user, sender=User, dispatch_uid='search-index-doctor-user')
+    post_save.connect(reindex_specialty, sender=MedicalSpecialty, dispatch_uid='search-index-specialty')
+    post_delete.connect(unindex_doctor, sender=Doctor, dispatch_uid='search-unindex-doctor')
+    post_delete.connect(unindex_specialty, sender=MedicalSpecialty, dispatch_uid='search-unindex-specialty')
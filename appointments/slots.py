@@ -0,0 +1,158 @@
+import calendar
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from django.db import transaction
+
+from .models import Doctor
+from .models import Slot
+
+WORKING_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+
+def doctor_availability(doctor):
+    # Weekly working hours as stored on the doctor profile, e.g. {'Monday': {'start': '09:00', 'end': '17:00'}}
+    return {
+        day: {
+            'start': getattr(doctor, f"{day.lower()}_start", None),
+            'end': getattr(doctor, f"{day.lower()}_end", None),
+        }
+        for day in WORKING_DAYS
+    }
+
+
+def build_slot_grid(availability, appointment_duration):
+    # Compute every (day, start_time, end_time) slot in memory, without touching the database
+    step = timedelta(minutes=appointment_duration)
+    grid = []
+
+    for day, times in availability.items():
+        start_time = times['start']
+        end_time = times['end']
+
+        if not start_time or not end_time:  # Skip days without availability
+            continue
+
+        start_time = datetime.strptime(start_time, '%H:%M').time()
+        end_time = datetime.strptime(end_time, '%H:%M').time()
+
+        current_time = datetime.combine(datetime.today(), start_time)
+
+        while current_time.time() < end_time:
+            slot_start = current_time.time()
+            slot_end = (current_time + step).time()
+
+            # Ensure slot_end doesn't exceed end_time
+            if slot_end > end_time:
+                break
+
+            grid.append((day, slot_start, slot_end))
+            current_time += step
+
+    return grid
+
+
+def save_slot_grid(doctor, grid):
+    # Diff the grid against the doctor's existing slots in one query and insert only the missing ones
+    with transaction.atomic():
+        # Lock the doctor row so two concurrent regenerations can't both insert the same slots
+        Doctor.objects.select_for_update().filter(pk=doctor.pk).first()
+
+        existing = set(
+            Slot.objects.filter(doctor=doctor).values_list('day', 'start_time', 'end_time')
+        )
+        missing = [entry for entry in grid if entry not in existing]
+
+        Slot.objects.bulk_create([
+            Slot(doctor=doctor, day=day, start_time=start_time, end_time=end_time, reserved=False)
+            for day, start_time, end_time in missing
+        ])
+
+    return missing
+
+
+def _slot_conflict(index, entry, message):
+    return {
+        'index': index,
+        'day': entry.get('day'),
+        'start_time': entry.get('start_time'),
+        'end_time': entry.get('end_time'),
+        'message': message,
+    }
+
+
+def import_slots(doctor, entries):
+    # Validate a list of {'day', 'start_time', 'end_time'} entries, check overlaps in memory and insert
+    # every valid slot with one bulk_create. Returns (created, conflicts); conflicts keep the entry index.
+    conflicts = []
+    parsed = []
+
+    for index, entry in enumerate(entries):
+        day = entry.get('day')
+        if day not in calendar.day_name:
+            conflicts.append(_slot_conflict(index, entry, 'Invalid day.'))
+            continue
+
+        try:
+            start_time = datetime.strptime(entry.get('start_time'), '%H:%M').time()
+            end_time = datetime.strptime(entry.get('end_time'), '%H:%M').time()
+        except (TypeError, ValueError):
+            conflicts.append(_slot_conflict(index, entry, 'Invalid time format.'))
+            continue
+
+        if start_time >= end_time:
+            conflicts.append(_slot_conflict(index, entry, 'Start time must be before end time.'))
+            continue
+
+        parsed.append((day, start_time, end_time, index))
+
+    with transaction.atomic():
+        # Lock the doctor row so concurrent imports can't interleave between the check and the insert
+        Doctor.objects.select_for_update().filter(pk=doctor.pk).first()
+
+        # Existing slots for the affected days, loaded once and sorted by start time
+        existing_by_day = {}
+        existing = Slot.objects.filter(
+            doctor=doctor,
+            day__in={day for day, _, _, _ in parsed},
+        ).order_by('start_time').values_list('day', 'start_time', 'end_time')
+        for day, start_time, end_time in existing:
+            existing_by_day.setdefault(day, []).append((start_time, end_time))
+
+        # Per day: the sorted start times and the running maximum of end times, so an overlap check
+        # against the existing slots is one bisect
+        existing_index = {}
+        for day, intervals in existing_by_day.items():
+            max_ends = []
+            for _, end_time in intervals:
+                max_ends.append(max(max_ends[-1], end_time) if max_ends else end_time)
+            existing_index[day] = ([start_time for start_time, _ in intervals], max_ends)
+
+        accepted_by_day = {}
+        for day, start_time, end_time, index in sorted(parsed):
+            starts, max_ends = existing_index.get(day, ([], []))
+            position = bisect_left(starts, end_time)
+            if position and max_ends[position - 1] > start_time:
+                conflicts.append(_slot_conflict(index, entries[index], 'Slot overlaps with an existing one.'))
+                continue
+
+            # Entries are visited in start order, so only the last accepted one of the day can overlap
+            accepted = accepted_by_day.setdefault(day, [])
+            if accepted and accepted[-1][1] > start_time:
+                conflicts.append(_slot_conflict(index, entries[index], 'Slot overlaps with another slot in this import.'))
+                continue
+
+            accepted.append((start_time, end_time))
+
+        created = [
+            (day, start_time, end_time)
+            for day, intervals in accepted_by_day.items()
+            for start_time, end_time in intervals
+        ]
+        Slot.objects.bulk_create([
+            Slot(doctor=doctor, day=day, start_time=start_time, end_time=end_time, reserved=False)
+            for day, start_time, end_time in created
+        ])
+
+    conflicts.sort(key=lambda conflict: conflict['index'])
+    return created, conflicts
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+
+from .models import Appointment
+from .models import Doctor
+from .models import MedicalSpecialty
+
+# Counter name -> model it counts
+COUNTED_MODELS = {
+    'specialties': MedicalSpecialty,
+    'doctors': Doctor,
+    'appointments': Appointment,
+    'users': User,
+}
+
+STATISTICS_CACHE_KEY = 'site-statistics'
+
+
+class SiteStatistic(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+def reconcile_statistics(names=None):
+    # Recount from the source tables; used by the periodic task and to seed a missing counter
+    totals = {}
+    for name in names or COUNTED_MODELS:
+        totals[name] = COUNTED_MODELS[name].objects.count()
+        SiteStatistic.objects.update_or_create(name=name, defaults={'value': totals[name]})
+
+    cache.delete(STATISTICS_CACHE_KEY)
+    return totals
+
+
+def _apply_increment(name, delta):
+    updated = SiteStatistic.objects.filter(name=name).update(value=F('value') + delta)
+    if not updated:
+        reconcile_statistics([name])
+
+
+def increment_statistic(name, delta=1):
+    # Applied once the surrounding transaction commits, so bookings don't serialize on the counter row for
+    # the length of their transaction. A failed update is left to the periodic reconciliation.
+    transaction.on_commit(lambda: _apply_increment(name, delta), robust=True)
+
+
+def site_statistics():
+    # Totals for the home page: served from the cache, or from one query on the small counters table
+    totals = cache.get(STATISTICS_CACHE_KEY)
+    if totals is not None:
+        return totals
+
+    totals = dict(SiteStatistic.objects.values_list('name', 'value'))
+    missing = [name for name in COUNTED_MODELS if name not in totals]
+    if missing:
+        totals.update(reconcile_statistics(missing))
+
+    cache.set(STATISTICS_CACHE_KEY, totals, timeout=getattr(settings, 'SITE_STATISTICS_CACHE_TIMEOUT', 60))
+    return totals
+
+
+def _counter_name(sender):
+    for name, model in COUNTED_MODELS.items():
+        if sender is model:
+            return name
+    return None
+
+
+def count_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        increment_statistic(_counter_name(sender))
+
+
+def count_deleted(sender, instance, **kwargs):
+    increment_statistic(_counter_name(sender), -1)
+
+
+def connect_signals():
+    # Called from AppointmentsConfig.ready()
+    for counted_model in COUNTED_MODELS.values():
+        post_save.connect(count_created, sender=counted_model, dispatch_uid=f'site-statistics-created-{counted_model.__name__}')
+        post_delete.connect(count_deleted, sender=counted_model, dispatch_uid=f'site-statistics-deleted-{counted_model.__name__}')
@@ -0,0 +1,61 @@
+from celery import shared_task
+from celery.signals import task_prerun
+from PIL import Image, UnidentifiedImageError
+
+from .db_router import reset_routing
+from .expiry import sweep_expired_holds
+from .images import build_variants
+from .outbox import drain_outbox, purge_outbox
+from .search import rebuild_search_index
+from .stats import reconcile_statistics
+
+task_prerun.connect(reset_routing, dispatch_uid='replica-routing-reset')
+
+
+@shared_task
+def send_outbox_emails(max_batches=10):
+    # Drain the outbox batch by batch; emails that failed wait for their backoff and the next run
+    total_sent = 0
+    total_failed = 0
+
+    for _ in range(max_batches):
+        sent, failed = drain_outbox()
+        total_sent += sent
+        total_failed += failed
+        if not sent and not failed:
+            break
+
+    return {'sent': total_sent, 'failed': total_failed}
+
+
+@shared_task
+def purge_outbox_emails():
+    # Scheduled from beat daily
+    return {'deleted': purge_outbox()}
+
+
+@shared_task
+def reconcile_site_statistics():
+    # Periodic safety net for counters that drifted (bulk operations, raw SQL, failed signal handlers)
+    return reconcile_statistics()
+
+
+@shared_task
+def rebuild_search():
+    rebuild_search_index()
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def generate_thumbnails(name):
+    # Storage hiccups are worth retrying, but an upload Pillow can't decode (an OSError subclass too) fails
+    # the same way every time
+    try:
+        return build_variants(name)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as error:
+        raise ValueError(f'{name} is not a readable image: {error}') from error
+
+
+@shared_task
+def sweep_unconfirmed_appointments():
+    processed = sweep_expired_holds()
+    return {'processed': processed}
@@ -0,0 +1,15 @@
+from django import template
+
+from ..images import image_variant_urls
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_variant(image, variant='avatar', image_format='webp'):
+    # {% image_variant doctor.clinic_picture 'card' %} -> URL of the smallest fitting thumbnail, or the original
+    if not image:
+        return ''
+
+    urls = image_variant_urls(image.name).get(variant, {})
+    return urls.get(image_format) or urls.get('jpeg') or image.url
@@ -0,0 +1,1287 @@
+import csv
+import json
+import shutil
+import tempfile
+import threading
+import time as clock
+from datetime import datetime, time, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core import mail, signing
+from django.core.management import call_command, CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connections, IntegrityError, OperationalError, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test import modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .availability import _availability_version, available_slots_by_date, cached_available_slots_by_date, claim_slot
+from .availability import claimed_intervals, horizon_dates, invalidate_availability
+from .availability import claim_series, expand_series, SeriesConflict
+from .availability import SlotUnavailable
+from .batch_booking import book_batch
+from .benchmarks import measure, summarize
+from .cache_versions import bump_cache_version, cache_version
+from .calendar_feed import fold, ical_lines
+from .expiry import AppointmentHold, backfill_holds, sweep_expired_holds
+from .exports import csv_lines, EXPORT_FIELDS, export_rows, ndjson_lines
+from .db_router import PrimaryStickinessMiddleware, ReplicaRouter, STICKY_COOKIE, STICKY_SALT
+from .images import build_variants, ImageVariant, store_upload
+from .metrics import metrics_view, snapshot
+from .models import Appointment
+from .models import Client
+from .models import Comment
+from .models import Doctor
+from .models import Slot
+from .outbox import drain_outbox, OutboxEmail, purge_outbox, queue_mail
+from .page_cache import cache_public_page, page_cache_generation
+from .pagination import CURSOR_SALT, encode_cursor, InvalidCursor, keyset_page
+from .query_budget import observe_budgets, QUERY_BUDGETS
+from .ratings import DoctorRating
+from .search import DOCTOR, search, SearchTerm, SPECIALTY
+from .slots import import_slots
+from .stats import increment_statistic, reconcile_statistics, SiteStatistic
+from .tasks import generate_thumbnails
+from .views import group_slots_by_day, serializer
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+def make_doctor(username='doctor'):
+    return Doctor.objects.create(user=User.objects.create_user(username=username, password='secret'))
+
+
+def next_date(day_name):
+    # The next date (from tomorrow) that falls on the given weekday, so it is inside the booking horizon
+    today = datetime.today().date()
+    for offset in range(1, 8):
+        date = today + timedelta(days=offset)
+        if date.strftime('%A') == day_name:
+            return date
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AvailabilityCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.doctor = make_doctor()
+        self.date = next_date('Monday')
+        Slot.objects.create(doctor=self.doctor, day='Monday', start_time=time(9, 0), end_time=time(9, 30))
+
+    def slots_on(self, date):
+        return cached_available_slots_by_date(self.doctor)[date.strftime('%Y-%m-%d')]
+
+    def test_cached_payload_is_served_until_the_version_is_bumped(self):
+        self.assertEqual(len(self.slots_on(self.date)), 1)
+
+        # A write that skips invalidation is invisible: the cached payload is still served
+        Slot.objects.create(doctor=self.doctor, day='Monday', start_time=time(10, 0), end_time=time(10, 30))
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.slots_on(self.date)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_availability(self.doctor.id)
+
+        self.assertEqual(len(self.slots_on(self.date)), 2)
+
+    def test_version_is_bumped_only_after_commit(self):
+        version = _availability_version(self.doctor.id)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            invalidate_availability(self.doctor.id)
+            self.assertEqual(_availability_version(self.doctor.id), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertGreater(_availability_version(self.doctor.id), version)
+
+    def test_rolled_back_change_does_not_invalidate(self):
+        version = _availability_version(self.doctor.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    invalidate_availability(self.doctor.id)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(_availability_version(self.doctor.id), version)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OverlappingSlotTests(TestCase):
+    # Overlapping slot templates: a claim on one hides every slot it overlaps, as claiming would reject them
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.doctor = make_doctor()
+        self.date = next_date('Monday')
+        for start, end in [(time(9, 0), time(9, 30)), (time(9, 15), time(9, 45)), (time(9, 30), time(10, 0))]:
+            Slot.objects.create(doctor=self.doctor, day='Monday', start_time=start, end_time=end)
+        claim_slot(self.doctor.id, self.date, time(9, 0), time(9, 30), status=True)
+
+    def test_listed_slots_are_the_bookable_ones(self):
+        listed = [slot['start_time_24h'] for slot in available_slots_by_date(self.doctor)[self.date.strftime('%Y-%m-%d')]]
+
+        # 9:15 overlaps the claim; 9:30 only touches it
+        self.assertEqual(listed, ['09:30'])
+        with self.assertRaises(SlotUnavailable):
+            claim_slot(self.doctor.id, self.date, time(9, 15), time(9, 45), status=True)
+
+    def test_schedule_marks_overlapped_slots_reserved(self):
+        dates = horizon_dates(self.date - timedelta(days=1))
+        slots = Slot.objects.filter(doctor=self.doctor).order_by('start_time')
+
+        grouped = group_slots_by_day(slots, claimed_intervals(self.doctor.id, dates[0], dates[-1]), dates)
+
+        reserved = {slot['start_time']: slot['reserved_dates'] for slot in grouped['Monday']}
+        self.assertEqual(reserved, {
+            '09:00': [self.date.strftime('%Y-%m-%d')],
+            '09:15': [self.date.strftime('%Y-%m-%d')],
+            '09:30': [],
+        })
+        # The week flags are derived from the claims on every request, never stored
+        self.assertTrue(grouped['Monday'][1]['first_week_reserved'])
+        self.assertFalse(grouped['Monday'][1]['second_week_reserved'])
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    # Real transactions and one connection per thread, like concurrent requests
+    threads = 20
+
+    def test_exactly_one_concurrent_claim_wins(self):
+        doctor = make_doctor()
+        date = next_date('Tuesday')
+        Slot.objects.create(doctor=doctor, day='Tuesday', start_time=time(9, 0), end_time=time(9, 30))
+
+        barrier = threading.Barrier(self.threads)
+        outcomes = []
+        lock = threading.Lock()
+
+        def book():
+            try:
+                barrier.wait()
+                claim_slot(doctor.id, date, time(9, 0), time(9, 30), status=True)
+                outcome = 'won'
+            except SlotUnavailable:
+                outcome = 'slot taken'
+            except Exception as e:
+                outcome = repr(e)
+            finally:
+                connections.close_all()
+            with lock:
+                outcomes.append(outcome)
+
+        workers = [threading.Thread(target=book) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # Every loser gets the clean "slot taken" error, never a database error
+        self.assertEqual(outcomes.count('won'), 1, outcomes)
+        self.assertEqual(outcomes.count('slot taken'), self.threads - 1, outcomes)
+        self.assertEqual(Appointment.objects.filter(doctor_id=doctor.id, start_date=date).count(), 1)
+
+
+class ClaimErrorTests(TestCase):
+    # Only the races a claim is designed to lose become "slot taken"; other database errors propagate
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.date = next_date('Tuesday')
+        Slot.objects.create(doctor=self.doctor, day='Tuesday', start_time=time(9, 0), end_time=time(9, 30))
+
+    def claim(self, error):
+        with mock.patch.object(Appointment.objects, 'create', side_effect=error):
+            claim_slot(self.doctor.id, self.date, time(9, 0), time(9, 30), status=True)
+
+    def test_lost_races_are_reported_as_slot_taken(self):
+        for error in (
+            IntegrityError('UNIQUE constraint failed: appointments_appointment.start_time'),
+            OperationalError('database is locked'),
+        ):
+            with self.subTest(error=error), self.assertRaises(SlotUnavailable):
+                self.claim(error)
+
+    def test_other_integrity_errors_propagate(self):
+        with self.assertRaises(IntegrityError):
+            self.claim(IntegrityError('NOT NULL constraint failed: appointments_appointment.client_name'))
+
+    def test_other_operational_errors_propagate(self):
+        with self.assertRaises(OperationalError):
+            self.claim(OperationalError('no such column: appointments_appointment.client_name'))
+
+    def test_series_propagates_other_integrity_errors(self):
+        error = IntegrityError('FOREIGN KEY constraint failed')
+        with mock.patch.object(Appointment.objects, 'bulk_create', side_effect=error):
+            with self.assertRaises(IntegrityError):
+                claim_series(self.doctor.id, [self.date], time(9, 0), time(9, 30), status=True)
+
+        with mock.patch.object(Appointment.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(SeriesConflict):
+                claim_series(self.doctor.id, [self.date], time(9, 0), time(9, 30), status=True)
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    OUTBOX_RETRY_DELAY=60,
+    OUTBOX_MAX_ATTEMPTS=3,
+)
+class OutboxTests(TestCase):
+    def queue(self, subject='Appointment Confirmation'):
+        with mock.patch('appointments.tasks.send_outbox_emails.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                email = queue_mail(subject, 'Body', 'clinic@example.com', ['patient@example.com'])
+        delay.assert_called_once_with()
+        return email
+
+    def make_due(self):
+        OutboxEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_queued_email_is_sent_once(self):
+        self.queue('First')
+        self.queue('Second')
+
+        self.assertEqual(drain_outbox(), (2, 0))
+        self.assertEqual(sorted(message.subject for message in mail.outbox), ['First', 'Second'])
+
+        # Sent rows are never picked up again, even once they would be due
+        self.make_due()
+        self.assertEqual(drain_outbox(), (0, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(OutboxEmail.objects.filter(sent_at__isnull=True).count(), 0)
+
+    def test_failed_send_is_retried_with_backoff(self):
+        email = self.queue()
+
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=OSError('mail server down')):
+            self.assertEqual(drain_outbox(), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, 'mail server down')
+        self.assertIsNone(email.sent_at)
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=60))
+
+        # Not due yet: the backoff keeps it out of the next batch
+        self.assertEqual(drain_outbox(), (0, 0))
+
+        self.make_due()
+        self.assertEqual(drain_outbox(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        self.queue()
+
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=OSError('mail server down')):
+            for _ in range(3):
+                self.make_due()
+                self.assertEqual(drain_outbox(), (0, 1))
+
+            self.make_due()
+            self.assertEqual(drain_outbox(), (0, 0))
+
+        self.assertEqual(OutboxEmail.objects.get().attempts, 3)
+        self.assertEqual(mail.outbox, [])
+
+    def test_sent_bodies_are_cleared(self):
+        self.queue()
+
+        drain_outbox()
+
+        self.assertEqual(mail.outbox[0].body, 'Body')
+        self.assertEqual(OutboxEmail.objects.get().body, '')
+
+    @override_settings(OUTBOX_RETENTION_DAYS=7)
+    def test_purge_keeps_pending_and_recent_rows(self):
+        sent_long_ago = self.queue('Sent long ago')
+        sent_recently = self.queue('Sent recently')
+        abandoned = self.queue('Abandoned')
+        pending = self.queue('Pending')
+        drain_outbox()
+
+        eight_days_ago = timezone.now() - timedelta(days=8)
+        OutboxEmail.objects.filter(id=sent_long_ago.id).update(sent_at=eight_days_ago)
+        OutboxEmail.objects.filter(id__in=[abandoned.id, pending.id]).update(
+            sent_at=None, created_at=eight_days_ago, attempts=2,
+        )
+        OutboxEmail.objects.filter(id=abandoned.id).update(attempts=3)
+
+        self.assertEqual(purge_outbox(batch_size=1), 2)
+        self.assertEqual(
+            set(OutboxEmail.objects.values_list('id', flat=True)),
+            {sent_recently.id, pending.id},
+        )
+
+
+class ExpandSeriesTests(TestCase):
+    def test_end_date_before_start_date_is_rejected(self):
+        start_date = next_date('Monday')
+        with self.assertRaises(ValueError):
+            expand_series(start_date, start_date - timedelta(days=1), 1, 'week')
+
+    def test_series_includes_start_and_end_dates(self):
+        start_date = next_date('Monday')
+        self.assertEqual(
+            expand_series(start_date, start_date + timedelta(weeks=2), 1, 'weeks'),
+            [start_date, start_date + timedelta(weeks=1), start_date + timedelta(weeks=2)],
+        )
+
+
+class SiteStatisticsTests(TestCase):
+    def setUp(self):
+        reconcile_statistics()
+
+    def value(self, name):
+        return SiteStatistic.objects.get(name=name).value
+
+    def test_counter_is_updated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            increment_statistic('appointments', 3)
+            self.assertEqual(self.value('appointments'), 0)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.value('appointments'), 3)
+
+    def test_rolled_back_create_is_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    make_doctor()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(self.value('doctors'), 0)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        SearchTerm.objects.all().delete()
+        SearchTerm.objects.bulk_create([
+            SearchTerm(term='anna', kind=DOCTOR, object_id=1, weight=3.0),
+            SearchTerm(term='cardiology', kind=DOCTOR, object_id=1, weight=2.0),
+            SearchTerm(term='anna', kind=DOCTOR, object_id=2, weight=3.0),
+            SearchTerm(term='cardiology', kind=DOCTOR, object_id=3, weight=2.0),
+            SearchTerm(term='cardiac', kind=DOCTOR, object_id=3, weight=1.0),
+            SearchTerm(term='cardiology', kind=SPECIALTY, object_id=1, weight=3.0),
+        ])
+
+    def hits(self, query, **kwargs):
+        return [(row['kind'], row['object_id']) for row in search(query, **kwargs)]
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.hits('anna cardio'), [(DOCTOR, 1)])
+        self.assertEqual(self.hits('anna smith'), [])
+
+    def test_earlier_words_match_whole_terms_only(self):
+        self.assertEqual(self.hits('ann cardiology'), [])
+
+    def test_a_prefix_hitting_several_terms_counts_once(self):
+        rows = {(row['kind'], row['object_id']): row for row in search('cardi')}
+
+        self.assertEqual(set(rows), {(DOCTOR, 1), (DOCTOR, 3), (SPECIALTY, 1)})
+        self.assertEqual(rows[(DOCTOR, 3)]['matched'], 1)
+        self.assertEqual(rows[(DOCTOR, 3)]['score'], 3.0)
+
+    def test_object_ids_of_one_kind(self):
+        ids = search('cardio', kinds=[SPECIALTY]).values_list('object_id', flat=True)
+        self.assertEqual(list(ids), [1])
+
+
+class RatingTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.client_user = User.objects.create_user(username='client', password='secret')
+
+    def rate(self, *ratings):
+        return [Comment.objects.create(doctor=self.doctor, user=self.client_user, rating=rating) for rating in ratings]
+
+    def test_ratings_are_aggregated_and_removed(self):
+        first, _ = self.rate(5, 2)
+        first.delete()
+
+        summary = DoctorRating.objects.get(doctor=self.doctor)
+        self.assertEqual((summary.count, summary.total, summary.average), (1, 2, 2.0))
+        self.assertEqual(summary.histogram, {1: 0, 2: 1, 3: 0, 4: 0, 5: 0})
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.rating, 2.0)
+
+    def test_deleting_a_rated_doctor(self):
+        self.rate(4, 5)
+
+        self.doctor.delete()
+
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(DoctorRating.objects.exists())
+
+    def test_deleting_the_users_of_a_rated_doctor(self):
+        self.rate(4, 5)
+
+        self.doctor.user.delete()
+        self.client_user.delete()
+
+        self.assertFalse(Doctor.objects.exists())
+        self.assertFalse(DoctorRating.objects.exists())
+
+
+class ProfilePictureTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+        self.doctor = make_doctor()
+        self.doctor.contact = '555-0100'
+        self.doctor.save()
+        self.doctor.user.groups.add(Group.objects.get_or_create(name='Doctor')[0])
+        self.client.force_login(self.doctor.user)
+
+    def image(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_only_the_forms_file_fields_are_stored(self):
+        with override_settings(MEDIA_ROOT=self.media_root), mock.patch('appointments.views.queue_thumbnails') as queued:
+            response = self.client.post(reverse('update_profile_picture'), {
+                'profile_picture': self.image('me.png'),
+                'clinic_picture': self.image('clinic.png'),
+                'contact': self.image('contact.png'),
+            })
+
+        self.assertEqual(response.status_code, 302)
+        self.doctor.refresh_from_db()
+        self.assertTrue(self.doctor.profile_picture.name.startswith('uploads/profile/'))
+        self.assertFalse(self.doctor.clinic_picture)
+        self.assertEqual(self.doctor.contact, '555-0100')
+        self.assertEqual(queued.call_count, 1)
+
+    def rate_while_uploading(self, rating):
+        # Stands in for a comment landing between the view loading the doctor and saving the upload
+        def store(uploaded_file, prefix):
+            Doctor.objects.filter(pk=self.doctor.pk).update(rating=rating)
+            return store_upload(uploaded_file, prefix)
+        return mock.patch('appointments.views.store_upload', side_effect=store)
+
+    def test_uploads_keep_a_concurrent_rating_update(self):
+        with override_settings(MEDIA_ROOT=self.media_root), mock.patch('appointments.views.queue_thumbnails'):
+            with self.rate_while_uploading(4.5):
+                self.client.post(reverse('update_profile_picture'), {'profile_picture': self.image('me.png')})
+            self.doctor.refresh_from_db()
+            self.assertEqual(self.doctor.rating, 4.5)
+
+            with self.rate_while_uploading(3.5):
+                self.client.post(reverse('upload_clinic_photo'), {'clinic_photo': self.image('clinic.png')})
+
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.rating, 3.5)
+        self.assertTrue(self.doctor.profile_picture.name.startswith('uploads/profile/'))
+        self.assertTrue(self.doctor.clinic_picture.name.startswith('uploads/clinic/'))
+
+    def test_unreadable_uploads_fail_without_a_retry(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            name = store_upload(SimpleUploadedFile('notes.png', b'not an image'), 'profile')
+
+            with mock.patch('appointments.tasks.build_variants', wraps=build_variants) as build:
+                result = generate_thumbnails.apply(args=(name,), throw=False)
+
+        self.assertTrue(result.failed())
+        self.assertIsInstance(result.result, ValueError)
+        self.assertEqual(build.call_count, 1)
+        self.assertFalse(ImageVariant.objects.exists())
+
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsViewTests(TestCase):
+    def get(self, user=None, **headers):
+        request = RequestFactory().get('/metrics', REMOTE_ADDR='127.0.0.1', **headers)
+        request.user = user or AnonymousUser()
+        return metrics_view(request)
+
+    def test_bearer_token_is_required(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_no_token_configured_means_staff_only(self):
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+        staff = User.objects.create_user(username='staff', password='secret', is_staff=True)
+        self.assertEqual(self.get(user=staff).status_code, 200)
+
+
+class BenchmarkToolTests(TestCase):
+    def test_summary_of_no_successful_runs(self):
+        self.assertEqual(summarize([], []), {'runs': 0, 'failures': 0})
+
+    def test_error_responses_are_failures_not_timings(self):
+        responses = iter([HttpResponse(), HttpResponse(status=500), HttpResponse(status=400)])
+
+        result = measure(lambda: next(responses), 3)
+
+        self.assertEqual((result['runs'], result['failures']), (1, 2))
+        self.assertEqual(result['statuses'], [200, 400, 500])
+
+    def test_seeding_twice_in_a_row(self):
+        for seed in (1, 2):
+            call_command(
+                'seed_benchmark_data', doctors=1, clients=2, appointments=2, comments=1,
+                slots_per_doctor=5, seed=seed, stdout=StringIO(),
+            )
+
+        self.assertEqual(Doctor.objects.count(), 2)
+
+    def test_seeded_appointments_never_share_a_slot(self):
+        # One doctor with five weekly slots over 55 weeks: exactly 275 distinct (slot, date) pairs
+        call_command(
+            'seed_benchmark_data', doctors=1, clients=2, appointments=275, comments=0,
+            slots_per_doctor=5, batch_size=100, stdout=StringIO(),
+        )
+
+        claims = list(Appointment.objects.values_list('doctor_id', 'start_date', 'start_time'))
+        self.assertEqual(len(claims), 275)
+        self.assertEqual(len(set(claims)), 275)
+        slots = set(Slot.objects.values_list('doctor_id', 'day', 'start_time'))
+        for doctor_id, start_date, start_time in claims:
+            self.assertIn((doctor_id, start_date.strftime('%A'), start_time), slots)
+
+        with self.assertRaises(CommandError):
+            call_command(
+                'seed_benchmark_data', doctors=1, clients=2, appointments=276, comments=0,
+                slots_per_doctor=5, stdout=StringIO(),
+            )
+
+
+@override_settings(CACHES=LOCMEM_CACHES, QUERY_BUDGET_MODE='raise')
+class BookingQueryBudgetTests(TransactionTestCase):
+    # Not TestCase: on_commit work (counters, cache version, outbox delivery) has to run inside the view,
+    # as it does in production, to be counted against the budget
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.doctor = make_doctor()
+        self.date = next_date('Monday')
+        Slot.objects.create(doctor=self.doctor, day='Monday', start_time=time(9, 0), end_time=time(9, 30))
+        reconcile_statistics()
+
+        patient = User.objects.create_user(username='patient', password='secret')
+        Client.objects.create(user=patient)
+        self.client.force_login(patient)
+
+    def book(self, **extra):
+        form = {
+            'doctor_id': self.doctor.id,
+            'start_date': self.date.strftime('%Y-%m-%d'),
+            'start_time': '09:00',
+            'end_time': '09:30',
+            'clinic': 'Clinic',
+        }
+        form.update(extra)
+
+        with observe_budgets() as observed:
+            response = self.client.post(reverse('book_appointment'), data=form)
+
+        self.assertEqual(response.status_code, 302)
+        return observed['book_appointment']
+
+    def test_one_time_booking_is_within_budget(self):
+        queries = self.book(one_time='on')
+        self.assertLessEqual(queries, QUERY_BUDGETS['book_appointment'])
+
+    def test_recurring_booking_is_within_budget(self):
+        queries = self.book(
+            repeat_every='1', repeat_unit='week', end_date=(self.date + timedelta(weeks=3)).strftime('%Y-%m-%d'),
+        )
+        self.assertEqual(Appointment.objects.count(), 4)
+        self.assertLessEqual(queries, QUERY_BUDGETS['book_appointment'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class PrimaryStickinessTests(SimpleTestCase):
+    # Routing decisions only, no queries: outside a test transaction, so reads are free to go to the replica
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.reads = []
+        self.writes = []
+
+    def respond(self, request, write=False):
+        if write:
+            self.writes.append(self.router.db_for_write(Appointment))
+        self.reads.append(self.router.db_for_read(Appointment))
+        return HttpResponse()
+
+    def request(self, write=False, cookie=None):
+        request = RequestFactory().get('/')
+        if cookie is not None:
+            request.COOKIES[STICKY_COOKIE] = cookie
+        middleware = PrimaryStickinessMiddleware(lambda request: self.respond(request, write))
+        return middleware(request)
+
+    def sticky_cookie(self, until):
+        response = HttpResponse()
+        response.set_signed_cookie(STICKY_COOKIE, str(until), salt=STICKY_SALT)
+        return response.cookies[STICKY_COOKIE].value
+
+    def test_reads_go_to_the_replica_without_a_write(self):
+        response = self.request()
+
+        self.assertEqual(self.reads, ['replica'])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_a_write_pins_the_rest_of_the_request_and_sets_the_cookie(self):
+        response = self.request(write=True)
+
+        self.assertEqual(self.writes, ['default'])
+        self.assertEqual(self.reads, ['default'])
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+    def test_the_cookie_pins_the_next_request_to_the_primary(self):
+        cookie = self.request(write=True).cookies[STICKY_COOKIE].value
+
+        self.request(cookie=cookie)
+
+        self.assertEqual(self.reads, ['default', 'default'])
+
+    def test_expired_or_forged_cookies_are_ignored(self):
+        self.request(cookie=self.sticky_cookie(until=0))
+        self.request(cookie=f'{clock.time() + 60}:forged')
+
+        self.assertEqual(self.reads, ['replica', 'replica'])
+
+    async def test_async_requests_are_pinned_too(self):
+        async def respond(request):
+            return self.respond(request)
+
+        cookie = self.sticky_cookie(until=clock.time() + 60)
+        request = RequestFactory().get('/')
+        request.COOKIES[STICKY_COOKIE] = cookie
+
+        await PrimaryStickinessMiddleware(respond)(request)
+
+        self.assertEqual(self.reads, ['default'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@modify_settings(MIDDLEWARE={'append': 'appointments.metrics.ViewMetricsMiddleware'})
+class ViewMetricsTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.doctor = make_doctor()
+        Slot.objects.create(doctor=self.doctor, day='Monday', start_time=time(9, 0), end_time=time(9, 30))
+
+        patient = User.objects.create_user(username='patient', password='secret')
+        self.client.force_login(patient)
+        self.async_client.force_login(patient)
+
+    def queries_of(self, view_name):
+        return snapshot().get(view_name, {}).get('queries', 0)
+
+    def test_sql_is_counted_for_sync_views(self):
+        before = self.queries_of('fetch_slots_for_two_weeks_by_id')
+
+        response = self.client.get(reverse('fetch_slots_for_two_weeks_by_id', kwargs={'doctor_id': self.doctor.id}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.queries_of('fetch_slots_for_two_weeks_by_id'), before)
+
+    async def test_sql_is_counted_for_async_views(self):
+        before = self.queries_of('fetch_slots_for_two_weeks_by_id_async')
+
+        response = await self.async_client.get(
+            reverse('fetch_slots_for_two_weeks_by_id_async', kwargs={'doctor_id': self.doctor.id})
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.queries_of('fetch_slots_for_two_weeks_by_id_async'), before)
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.patient = User.objects.create_user(username='patient', password='secret')
+        self.date = next_date('Monday')
+        Slot.objects.create(doctor=self.doctor, day='Monday', start_time=time(9, 0), end_time=time(9, 30))
+        claim_slot(
+            self.doctor.id, self.date, time(9, 0), time(9, 30), status=True,
+            doctor_name='Dr. Ana Ionescu', client_id=self.patient.id, client_name='Maria Popescu',
+            doctor_clinic='Clinica Sănătatea Familiei', doctor_address='Strada Lungă 123, ' * 5,
+        )
+
+    def feed_url(self, user, method='get'):
+        self.client.force_login(user)
+        response = getattr(self.client, method)(reverse('calendar_feed_link'))
+        self.client.logout()
+        return response.json()['url'].split('/calendar-feed/', 1)[1]
+
+    def get_feed(self, token, **headers):
+        return self.client.get(reverse('calendar_feed', kwargs={'token': token.rstrip('/')}), headers=headers)
+
+    def test_doctor_and_patient_feeds(self):
+        for user in (self.doctor.user, self.patient):
+            with self.subTest(user=user.username):
+                response = self.get_feed(self.feed_url(user))
+                body = b''.join(response.streaming_content).decode()
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body.count('BEGIN:VEVENT'), 1)
+
+    def test_rotating_revokes_earlier_links(self):
+        old = self.feed_url(self.doctor.user)
+        self.assertEqual(self.feed_url(self.doctor.user), old)
+
+        new = self.feed_url(self.doctor.user, method='post')
+
+        self.assertNotEqual(new, old)
+        self.assertEqual(self.get_feed(old).status_code, 404)
+        self.assertEqual(self.get_feed(new).status_code, 200)
+
+    def test_tampered_tokens_are_not_found(self):
+        token = self.feed_url(self.patient).rstrip('/')
+        self.assertEqual(self.get_feed(token[:-2] + 'xx').status_code, 404)
+        self.assertEqual(self.get_feed('garbage').status_code, 404)
+
+    def test_if_none_match(self):
+        token = self.feed_url(self.patient)
+        etag = self.get_feed(token)['ETag']
+
+        for header in (etag, f'"other", {etag}', f'W/{etag}', '*'):
+            with self.subTest(header=header):
+                response = self.get_feed(token, if_none_match=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+        # A substring of the ETag is a different ETag
+        self.assertEqual(self.get_feed(token, if_none_match=etag[:-3] + '"').status_code, 200)
+
+    def test_long_lines_are_folded_at_75_octets(self):
+        body = ''.join(ical_lines(Appointment.objects.all(), 'Appointments', 'testserver'))
+
+        lines = body.split('\r\n')
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        self.assertTrue(any(line.startswith(' ') for line in lines))
+        unfolded = body.replace('\r\n ', '')
+        self.assertIn('LOCATION:Clinica Sănătatea Familiei\\, ' + 'Strada Lungă 123\\, ' * 5, unfolded)
+
+    def test_fold_never_splits_a_character(self):
+        line = 'SUMMARY:' + 'ă' * 100
+
+        folded = fold(line)
+
+        self.assertEqual(folded.replace('\r\n ', ''), line + '\r\n')
+        self.assertTrue(all(len(part.encode()) <= 75 for part in folded.split('\r\n')))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.other = make_doctor('other')
+        self.date = next_date('Monday')
+        for doctor in (self.doctor, self.other):
+            Slot.objects.create(doctor=doctor, day='Monday', start_time=time(9, 0), end_time=time(9, 30))
+            claim_slot(doctor.id, self.date, time(9, 0), time(9, 30), status=True, client_name='Maria, "Mara" Pop')
+
+    def export(self, user, **params):
+        self.client.force_login(user)
+        return self.client.get(reverse('export_appointments'), params)
+
+    def test_csv_lines_quote_values(self):
+        body = ''.join(csv_lines(export_rows({'doctor_id': self.doctor.id})))
+
+        header, row = list(csv.reader(body.splitlines()))
+        self.assertEqual(header, EXPORT_FIELDS)
+        self.assertEqual(dict(zip(header, row))['client_name'], 'Maria, "Mara" Pop')
+
+    def test_ndjson_lines_are_one_object_each(self):
+        lines = list(ndjson_lines(export_rows({})))
+
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['start_date'], self.date.strftime('%Y-%m-%d'))
+        self.assertEqual(rows[0]['start_time'], '09:00:00')
+
+    def test_doctors_export_only_their_own_schedule(self):
+        response = self.export(self.doctor.user, format='ndjson', doctor_id=self.other.id)
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['doctor_id'] for row in rows], [self.doctor.id])
+
+    def test_staff_export_filters(self):
+        staff = User.objects.create_user(username='staff', password='secret', is_staff=True)
+
+        response = self.export(staff, doctor_id=self.other.id)
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(body.splitlines()), 2)
+
+    def test_invalid_parameters_are_rejected_before_streaming(self):
+        staff = User.objects.create_user(username='staff', password='secret', is_staff=True)
+
+        for params in ({'doctor_id': 'abc'}, {'format': 'xml'}, {'start': '2024-13-01'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.export(staff, **params).status_code, 400)
+
+
+@override_settings(APPOINTMENT_CONFIRMATION_MAX_AGE=600)
+class ExpiryTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.date = next_date('Monday')
+        self.slots = [
+            Slot.objects.create(doctor=self.doctor, day='Monday', start_time=time(9 + hour, 0), end_time=time(9 + hour, 30))
+            for hour in range(5)
+        ]
+
+    def book(self, slot, status=False):
+        return claim_slot(self.doctor.id, self.date, slot.start_time, slot.end_time, status=status)
+
+    def expire_all(self):
+        AppointmentHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_unconfirmed_bookings_hold_for_the_configured_time(self):
+        before = timezone.now()
+        appointment = self.book(self.slots[0])
+
+        expires_at = appointment.hold.expires_at
+        self.assertGreaterEqual(expires_at, before + timedelta(seconds=600))
+        self.assertLess(expires_at, before + timedelta(seconds=660))
+        self.assertFalse(AppointmentHold.objects.filter(appointment=self.book(self.slots[1], status=True)).exists())
+
+    def test_expired_bookings_are_deleted_and_their_slot_freed(self):
+        self.book(self.slots[0])
+        self.expire_all()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sweep_expired_holds(), 1)
+
+        self.assertFalse(Appointment.objects.exists())
+        self.book(self.slots[0])
+
+    def test_confirming_before_expiry_keeps_the_booking(self):
+        appointment = self.book(self.slots[0])
+        token = serializer.dumps(appointment.id, salt='appointment-confirmation')
+
+        self.client.force_login(User.objects.create_user(username='patient', password='secret'))
+        self.client.get(reverse('confirm_appointment', kwargs={'token': token}))
+        self.expire_all()
+
+        self.assertEqual(sweep_expired_holds(), 0)
+        appointment.refresh_from_db()
+        self.assertTrue(appointment.status)
+
+    def test_confirmed_bookings_with_a_leftover_hold_survive_the_sweep(self):
+        appointment = self.book(self.slots[0])
+        Appointment.objects.filter(id=appointment.id).update(status=True)
+        self.expire_all()
+
+        self.assertEqual(sweep_expired_holds(), 1)
+        self.assertTrue(Appointment.objects.filter(id=appointment.id).exists())
+        self.assertFalse(AppointmentHold.objects.exists())
+
+    def test_sweep_stops_at_the_batch_limits(self):
+        for slot in self.slots:
+            self.book(slot)
+        self.expire_all()
+
+        self.assertEqual(sweep_expired_holds(batch_size=2, max_batches=2), 4)
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(sweep_expired_holds(batch_size=2, max_batches=2), 1)
+        self.assertEqual(sweep_expired_holds(batch_size=2, max_batches=2), 0)
+
+    def test_backfill_gives_legacy_bookings_a_hold(self):
+        for slot in self.slots[:3]:
+            self.book(slot)
+        confirmed = self.book(self.slots[3], status=True)
+        AppointmentHold.objects.all().delete()
+
+        self.assertEqual(backfill_holds(batch_size=2), 3)
+        self.assertEqual(AppointmentHold.objects.count(), 3)
+        self.assertFalse(AppointmentHold.objects.filter(appointment=confirmed).exists())
+        self.assertEqual(backfill_holds(), 0)
+
+    def test_backfill_command_reports_the_count(self):
+        self.book(self.slots[0])
+        AppointmentHold.objects.all().delete()
+        out = StringIO()
+
+        call_command('backfill_appointment_holds', '--batch-size', '10', stdout=out)
+
+        self.assertIn('Created holds for 1 unconfirmed appointments.', out.getvalue())
+
+
+class BatchBookingTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+        self.date = next_date('Monday')
+        for start, end in [((9, 0), (9, 30)), ((9, 15), (9, 45)), ((9, 30), (10, 0)), ((10, 0), (10, 30))]:
+            Slot.objects.create(doctor=self.doctor, day='Monday', start_time=time(*start), end_time=time(*end))
+
+        self.patients = []
+        for number in range(3):
+            user = User.objects.create_user(username=f'patient{number}', email=f'patient{number}@example.com')
+            Client.objects.create(user=user)
+            self.patients.append(user)
+
+    def item(self, start, end, patient=0, **extra):
+        item = {
+            'doctor_id': self.doctor.id,
+            'client_id': self.patients[patient].id,
+            'date': self.date.strftime('%Y-%m-%d'),
+            'start_time': start,
+            'end_time': end,
+        }
+        item.update(extra)
+        return item
+
+    def statuses(self, results):
+        return [result['status'] for result in results]
+
+    def test_overlapping_entries_in_the_same_batch_conflict(self):
+        results, appointments = book_batch([
+            self.item('09:00', '09:30'),
+            self.item('09:15', '09:45', patient=1),
+            self.item('09:30', '10:00', patient=2),
+        ])
+
+        # Touching intervals don't overlap; the entry straddling both loses to the earlier one
+        self.assertEqual(self.statuses(results), ['booked', 'conflict', 'booked'])
+        self.assertEqual([result['index'] for result in results], [0, 1, 2])
+        self.assertEqual(len(appointments), 2)
+
+    def test_overlap_with_an_existing_appointment_conflicts(self):
+        claim_slot(self.doctor.id, self.date, time(9, 0), time(9, 30), status=True)
+
+        results, appointments = book_batch([self.item('09:15', '09:45'), self.item('09:30', '10:00')])
+
+        self.assertEqual(self.statuses(results), ['conflict', 'booked'])
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    def test_invalid_and_unknown_entries_are_reported_in_place(self):
+        results, appointments = book_batch([
+            self.item('09:00', '09:30', date='not a date'),
+            self.item('11:00', '11:30'),
+            self.item('09:00', '09:30', doctor_id=0),
+            self.item('10:00', '10:30'),
+        ])
+
+        self.assertEqual(self.statuses(results), ['error', 'conflict', 'error', 'booked'])
+        self.assertEqual(results[3]['appointment_id'], appointments[0].id)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        with CaptureQueriesContext(connections['default']) as single:
+            book_batch([self.item('09:00', '09:30')])
+        Appointment.objects.all().delete()
+
+        with CaptureQueriesContext(connections['default']) as several:
+            book_batch([
+                self.item('09:00', '09:30'),
+                self.item('09:30', '10:00', patient=1),
+                self.item('10:00', '10:30', patient=2),
+            ])
+
+        self.assertEqual(len(several), len(single))
+        appointment_reads = [query for query in several if 'FROM "appointments_appointment"' in query['sql']]
+        self.assertEqual(len(appointment_reads), 1)
+
+    def test_a_failed_insert_books_nothing(self):
+        with mock.patch('appointments.batch_booking.hold_for_confirmation', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                book_batch([self.item('09:00', '09:30'), self.item('10:00', '10:30', patient=1)])
+
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_view_queues_one_email_per_booked_appointment(self):
+        staff = User.objects.create_user(username='front-desk', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        User.objects.filter(id=self.patients[2].id).update(email='')
+
+        with self.captureOnCommitCallbacks(execute=False), mock.patch('appointments.tasks.send_outbox_emails.delay'):
+            response = self.client.post(reverse('book_appointments_batch'), data=json.dumps({'bookings': [
+                self.item('09:00', '09:30'),
+                self.item('09:15', '09:45', patient=1),
+                self.item('10:00', '10:30', patient=1),
+                self.item('09:30', '10:00', patient=2),
+            ]}), content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['booked'], 3)
+
+        # The patient without an email address is booked but gets no email
+        emails = OutboxEmail.objects.order_by('id')
+        self.assertEqual([email.recipients for email in emails], [['patient0@example.com'], ['patient1@example.com']])
+        self.assertIn('/confirm-appointment-by-link/', emails[0].body)
+
+    def test_view_is_for_staff_only(self):
+        self.client.force_login(self.patients[0])
+        response = self.client.post(reverse('book_appointments_batch'), data='[]', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+class SlotImportTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor()
+
+    def add(self, day, start, end):
+        Slot.objects.create(doctor=self.doctor, day=day, start_time=time(*start), end_time=time(*end))
+
+    def entry(self, start, end, day='Monday'):
+        return {'day': day, 'start_time': start, 'end_time': end}
+
+    def test_overlap_with_a_long_slot_that_is_not_the_previous_one(self):
+        # 10:00-10:30 starts right before the new slot but ends early; 08:00-12:00 is what it overlaps
+        self.add('Monday', (8, 0), (12, 0))
+        self.add('Monday', (10, 0), (10, 30))
+
+        created, conflicts = import_slots(self.doctor, [self.entry('11:00', '11:30')])
+
+        self.assertEqual(created, [])
+        self.assertEqual([conflict['message'] for conflict in conflicts], ['Slot overlaps with an existing one.'])
+
+    def test_overlap_within_the_same_import(self):
+        created, conflicts = import_slots(self.doctor, [
+            self.entry('09:00', '10:00'),
+            self.entry('09:30', '10:30'),
+            self.entry('09:30', '10:30', day='Tuesday'),
+        ])
+
+        self.assertEqual(sorted(created), [
+            ('Monday', time(9, 0), time(10, 0)),
+            ('Tuesday', time(9, 30), time(10, 30)),
+        ])
+        self.assertEqual(conflicts[0]['index'], 1)
+        self.assertEqual(conflicts[0]['message'], 'Slot overlaps with another slot in this import.')
+        self.assertEqual(Slot.objects.count(), 2)
+
+    def test_touching_slots_are_accepted(self):
+        self.add('Monday', (9, 0), (9, 30))
+
+        created, conflicts = import_slots(self.doctor, [
+            self.entry('10:00', '10:30'),
+            self.entry('09:30', '10:00'),
+            self.entry('08:30', '09:00'),
+        ])
+
+        self.assertEqual(conflicts, [])
+        self.assertEqual(len(created), 3)
+        self.assertEqual(Slot.objects.filter(doctor=self.doctor).count(), 4)
+
+    def test_invalid_entries_are_rejected(self):
+        created, conflicts = import_slots(self.doctor, [
+            self.entry('09:00', '09:30', day='Someday'),
+            self.entry('9 am', '09:30'),
+            {'day': 'Monday', 'start_time': '09:00'},
+            self.entry('10:00', '09:30'),
+        ])
+
+        self.assertEqual(created, [])
+        self.assertEqual([conflict['message'] for conflict in conflicts], [
+            'Invalid day.',
+            'Invalid time format.',
+            'Invalid time format.',
+            'Start time must be before end time.',
+        ])
+        self.assertFalse(Slot.objects.exists())
+
+    def test_conflicts_follow_the_input_order(self):
+        self.add('Monday', (12, 0), (13, 0))
+
+        created, conflicts = import_slots(self.doctor, [
+            self.entry('12:30', '13:30'),
+            self.entry('09:15', '09:45'),
+            self.entry('bad', '09:30'),
+            self.entry('09:00', '09:30'),
+        ])
+
+        # Entry 3 starts first, so it is the one kept and entry 1 is the conflicting one
+        self.assertEqual(created, [('Monday', time(9, 0), time(9, 30))])
+        self.assertEqual([conflict['index'] for conflict in conflicts], [0, 1, 2])
+        self.assertEqual(conflicts[1]['start_time'], '09:15')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # Fees with ties and gaps, so the id tie-breaker and the NULLs-last rule both matter
+        self.fees = [300.0, None, 300.0, 100.0, None, 300.0, 700.0, 100.0]
+        self.doctors = []
+        for number, fee in enumerate(self.fees):
+            doctor = make_doctor(username=f'doctor{number}')
+            doctor.specialization = 'Cardiology'
+            doctor.consultation_fee = fee
+            doctor.save()
+            self.doctors.append(doctor)
+
+    def walk(self, keys, page_size):
+        ids = []
+        cursor = None
+        while True:
+            rows, cursor = keyset_page(Doctor.objects.all(), keys, cursor=cursor, page_size=page_size)
+            ids.extend(doctor.id for doctor in rows)
+            if cursor is None:
+                return ids
+
+    def expected(self, descending):
+        with_fee = [doctor for doctor in self.doctors if doctor.consultation_fee is not None]
+        without_fee = [doctor for doctor in self.doctors if doctor.consultation_fee is None]
+        ordered = sorted(with_fee, key=lambda doctor: (doctor.consultation_fee, doctor.id), reverse=descending)
+        return [doctor.id for doctor in ordered] + sorted((doctor.id for doctor in without_fee), reverse=descending)
+
+    def test_ascending_walk_breaks_ties_on_id_and_puts_nulls_last(self):
+        for page_size in (1, 2, 3, len(self.fees)):
+            ids = self.walk([('consultation_fee', False), ('id', False)], page_size)
+            self.assertEqual(ids, self.expected(descending=False))
+
+    def test_descending_walk_breaks_ties_on_id_and_puts_nulls_last(self):
+        for page_size in (1, 2, 3, len(self.fees)):
+            ids = self.walk([('consultation_fee', True), ('id', True)], page_size)
+            self.assertEqual(ids, self.expected(descending=True))
+
+    def test_rating_ties_are_walked_without_gaps_or_repeats(self):
+        for doctor, rating in zip(self.doctors, [4.5, 3.0, 4.5, 4.5, 5.0, 3.0, 4.5, 1.0]):
+            Doctor.objects.filter(id=doctor.id).update(rating=rating)
+
+        ids = self.walk([('rating', True), ('id', True)], page_size=3)
+
+        self.assertEqual(ids, list(
+            Doctor.objects.order_by('-rating', '-id').values_list('id', flat=True)
+        ))
+
+    def test_a_cursor_continues_after_the_last_row(self):
+        keys = [('consultation_fee', False), ('id', False)]
+        rows, cursor = keyset_page(Doctor.objects.all(), keys, page_size=3)
+        last = rows[-1]
+
+        self.assertEqual(cursor, encode_cursor([last.consultation_fee, last.id]))
+        rows, _ = keyset_page(Doctor.objects.all(), keys, cursor=cursor, page_size=3)
+        self.assertNotIn(last.id, [doctor.id for doctor in rows])
+
+    def test_tampered_or_mismatched_cursors_are_rejected(self):
+        keys = [('consultation_fee', False), ('id', False)]
+        _, cursor = keyset_page(Doctor.objects.all(), keys, page_size=3)
+
+        forged = signing.dumps([0, 0], key='not-the-secret-key', salt=CURSOR_SALT)
+        for bad_cursor in (forged, cursor[1:], 'garbage', encode_cursor([1])):
+            with self.assertRaises(InvalidCursor):
+                keyset_page(Doctor.objects.all(), keys, cursor=bad_cursor)
+
+    def test_tampered_cursor_is_a_bad_request(self):
+        url = reverse('specialty_details_json', kwargs={'specialty_name': 'Cardiology'})
+
+        response = self.client.get(url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+        first = self.client.get(url, {'sort': 'fee-low'}).json()
+        self.assertIsNone(first['next_cursor'])
+        self.assertEqual([doctor['id'] for doctor in first['doctors']], self.expected(descending=False))
+
+    def test_tampered_cursor_on_the_appointment_list_is_a_bad_request(self):
+        patient = User.objects.create_user(username='patient', password='secret')
+        Client.objects.create(user=patient)
+        self.client.force_login(patient)
+
+        response = self.client.get(reverse('client_appointments'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PublicPageCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+        self.calls = 0
+
+        @cache_public_page
+        def page(request):
+            self.calls += 1
+            return HttpResponse(f'render {self.calls}')
+
+        self.page = page
+
+    def get(self, user=None, **headers):
+        request = RequestFactory().get('/specialty/cardiology/', {'sort': 'rating', 'utm_source': 'mail'}, headers=headers)
+        request.user = user or AnonymousUser()
+        return self.page(request)
+
+    def test_anonymous_visitors_share_one_render(self):
+        first = self.get()
+        second = self.get()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertTrue(second['Cache-Control'].startswith('public'))
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_signed_in_users_bypass_the_cache(self):
+        user = User.objects.create_user(username='patient', password='secret')
+        self.get()
+
+        response = self.get(user=user)
+        self.get(user=user)
+
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_pending_messages_bypass_the_cache(self):
+        self.get()
+
+        with_cookie = self.get(cookie='messages=pending')
+        request = RequestFactory().get('/specialty/cardiology/')
+        request.user = AnonymousUser()
+        request.session = {'_messages': 'pending'}
+        with_session = self.page(request)
+
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(with_cookie['Cache-Control'], 'private, no-cache')
+        self.assertEqual(with_session['Cache-Control'], 'private, no-cache')
+
+    def test_matching_etag_gets_not_modified(self):
+        etag = self.get()['ETag']
+
+        self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+        self.assertEqual(self.get(if_none_match=f'"other", {etag}').status_code, 304)
+        self.assertEqual(self.get(if_none_match='*').status_code, 304)
+
+        # A partial match is not a match
+        partial = self.get(if_none_match=etag[:-3] + '"')
+        self.assertEqual(partial.status_code, 200)
+        self.assertEqual(self.calls, 1)
+
+    def test_saving_a_doctor_invalidates_every_page(self):
+        etag = self.get()['ETag']
+        generation = page_cache_generation()
+
+        make_doctor()
+
+        self.assertGreater(page_cache_generation(), generation)
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'render 2')
+
+    def test_evicted_versions_restart_above_their_old_value(self):
+        from django.core.cache import cache
+
+        with mock.patch('appointments.cache_versions.time.time', return_value=1000.0):
+            self.assertEqual(cache_version(cache, 'version-test'), 1000000)
+            bump_cache_version(cache, 'version-test')
+            self.assertEqual(cache_version(cache, 'version-test'), 1000001)
+
+        cache.delete('version-test')
+        with mock.patch('appointments.cache_versions.time.time', return_value=1001.0):
+            bump_cache_version(cache, 'version-test')
+        self.assertEqual(cache_version(cache, 'version-test'), 1001000)
@@ -1,12 +1,13 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login
 from django.contrib import messages
+from django import forms
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.hashers import make_password
-from django.core.mail import send_mail
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_decode
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from django.conf import settings
@@ -19,21 +20,42 @@ from .models import Comment
 from .models import Slot
 from .models import Appointment
 from django.shortcuts import get_object_or_404
+from django.core.paginator import Paginator
+from django.db.models import Count, Q
 from django.http import HttpResponseBadRequest
 from datetime import datetime, timedelta
 from django.http import JsonResponse
 import json
+import logging
 import pdb
 from django.views.decorators.csrf import csrf_exempt
 from datetime import datetime
-import calendar
-from itsdangerous import URLSafeTimedSerializer
-from django.utils.timezone import now
-from django.utils import timezone
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 from rest_framework.viewsets import ModelViewSet
 from .serializers import MedicalSpecialtySerializer
 from .celery_tasks import process_data
+from .outbox import queue_mail, queue_mails
+from .batch_booking import book_batch
+from .expiry import confirmation_max_age, release_holds
+from .stats import site_statistics
+from .search import load_hits, search, SPECIALTY
+from .pagination import InvalidCursor, keyset_page
+from .ratings import parse_rating
+from .exports import csv_lines, export_rows, ndjson_lines
+from .calendar_feed import feed_appointments, feed_etag, feed_filters, feed_nonce, ical_lines
+from .page_cache import cache_public_page
+from .query_budget import query_budget
+from .images import queue_thumbnails, store_upload
+from .slots import build_slot_grid, doctor_availability, import_slots, save_slot_grid
+from .availability import booking_horizon, cached_available_slots_by_date, claimed_intervals, horizon_dates
+from .availability import acached_available_slots_by_date, aclaimed_intervals, overlaps
+from .availability import claim_series, claim_slot, expand_series, invalidate_availability, SeriesConflict, SlotUnavailable
 from django.http import HttpResponseNotAllowed
+from django.http import StreamingHttpResponse
+from django.http import HttpResponseNotFound
+from django.utils.cache import get_conditional_response
+
+logger = logging.getLogger(__name__)
 
 serializer = URLSafeTimedSerializer(settings.SECRET_KEY)
 
@@ -48,18 +70,23 @@ def exemple_celery_function_process_data_view(request):
     
     return render(request, 'appointments/test_celery.html')
 
+@cache_public_page
+@query_budget(6)
 def home(request):
     query = request.GET.get('q')
 
     if query:
-        medical_specialties = MedicalSpecialty.objects.filter(name__icontains=query)
+        specialty_ids = search(query, kinds=[SPECIALTY]).values_list('object_id', flat=True)
+        medical_specialties = MedicalSpecialty.objects.filter(id__in=list(specialty_ids))
     else:
         medical_specialties = MedicalSpecialty.objects.all()
 
-    total_specialties = MedicalSpecialty.objects.count()
-    total_doctors = Doctor.objects.count()
-    total_appointments = Appointment.objects.count()
-    total_users = User.objects.count()
+    # Counters are maintained incrementally, so no COUNT(*) over the big tables here
+    totals = site_statistics()
+    total_specialties = totals['specialties']
+    total_doctors = totals['doctors']
+    total_appointments = totals['appointments']
+    total_users = totals['users']
 
     return render(request, 'appointments/home.html', {
         'medical_specialties': medical_specialties,
@@ -69,10 +96,11 @@ def home(request):
         'total_users': total_users,
     }, )
 
-def specialty_details(request, specialty_name):
+def specialty_doctors_page(request, specialty_name):
+    # Filtered, keyset-paginated doctors of a specialty, shared by the HTML page and the JSON listing
     query = request.GET.get('q')
 
-    doctors = Doctor.objects.filter(specialization__iexact=specialty_name)
+    doctors = Doctor.objects.filter(specialization__iexact=specialty_name).select_related('user')
 
     if query:
         doctors = doctors.filter(user__username__icontains=query)
@@ -98,13 +126,65 @@ def specialty_details(request, specialty_name):
     elif fee == 'high':
         doctors = doctors.filter(consultation_fee__gt=1000)
 
+    # Sort keys always end with the primary key so the cursor is unique
     sort = request.GET.get('sort')
     if sort == 'fee-low':
-        doctors = doctors.order_by('consultation_fee')
+        keys = [('consultation_fee', False), ('id', False)]
     elif sort == 'fee-high':
-        doctors = doctors.order_by('-consultation_fee')
+        keys = [('consultation_fee', True), ('id', True)]
+    elif sort == 'rating':
+        keys = [('rating', True), ('id', True)]
+    else:
+        keys = [('id', False)]
 
-    return render(request, 'appointments/doctors_page.html', {'specialty_name': specialty_name, 'doctors': doctors})
+    return keyset_page(
+        doctors,
+        keys,
+        cursor=request.GET.get('cursor'),
+        page_size=getattr(settings, 'DOCTORS_PER_PAGE', 20),
+    )
+
+@cache_public_page
+@query_budget(5)
+def specialty_details(request, specialty_name):
+    try:
+        doctors, next_cursor = specialty_doctors_page(request, specialty_name)
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor.')
+
+    return render(request, 'appointments/doctors_page.html', {
+        'specialty_name': specialty_name,
+        'doctors': doctors,
+        'next_cursor': next_cursor,
+    })
+
+@query_budget(3)
+def specialty_details_json(request, specialty_name):
+    try:
+        doctors, next_cursor = specialty_doctors_page(request, specialty_name)
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor.'}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'specialty_name': specialty_name,
+        'doctors': [
+            {
+                'id': doctor.id,
+                'username': doctor.user.username,
+                'name': f"Dr. {doctor.user.first_name} {doctor.user.last_name}",
+                'specialization': doctor.specialization,
+                'gender': doctor.gender,
+                'experience': doctor.experience,
+                'consultation_fee': doctor.consultation_fee,
+                'clinic_hospital': doctor.clinic_hospital,
+                'address': doctor.address,
+                'rating': doctor.rating,
+            }
+            for doctor in doctors
+        ],
+        'next_cursor': next_cursor,
+    })
 
 @login_required
 def add_comment(request, doctor_username):
@@ -112,7 +192,7 @@ def add_comment(request, doctor_username):
         doctor = get_object_or_404(Doctor, user__username=doctor_username)
         user_photo = request.user.profile_picture.url if hasattr(request.user, 'profile_picture') else None
         content = request.POST.get('content')
-        rating = request.POST.get('rating')
+        rating = parse_rating(request.POST.get('rating'))
 
         Comment.objects.create (
             doctor=doctor,
@@ -129,12 +209,23 @@ def update_profile_picture(request):
     profile, created = Doctor.objects.get_or_create(user=request.user)
 
     if request.method == 'POST':
-        print("POST request received")
+        logger.debug("Profile picture upload received")
         form = ProfilePictureForm(request.POST, request.FILES, instance=profile)
         if form.is_valid():
-            print("Form is valid")
-            form.save()
-            print("Profile photo updated")
+            profile = form.save(commit=False)
+
+            # Store each uploaded image once under its content hash and build the thumbnails in the background.
+            # Only the form's own file fields are taken, never arbitrary keys from request.FILES.
+            for field_name, field in form.fields.items():
+                if not isinstance(field, forms.FileField) or field_name not in request.FILES:
+                    continue
+                stored_name = store_upload(form.cleaned_data[field_name], 'profile')
+                setattr(profile, field_name, stored_name)
+                queue_thumbnails(stored_name)
+
+            # Only the form's fields: a full save would write back a rating read before a concurrent comment
+            profile.save(update_fields=list(form.fields))
+            logger.debug("Profile photo updated for user %s", request.user.id)
 
             if request.user.groups.filter(name='Doctor').exists():
                 return redirect('doctor_profile')
@@ -142,7 +233,7 @@ def update_profile_picture(request):
                 return redirect('client_profile')
             
         else:
-            print("Form is invalid")
+            logger.info("Invalid profile picture form: %s", form.errors.as_json())
     else:
         form = ProfilePictureForm(instance=profile)
 
@@ -210,7 +301,8 @@ def update_doctor_profile_proffessional(request):
         doctor.certifications = certifications
         doctor.professional_description = professional_description
 
-        doctor.save()
+        # Only the edited fields, so a rating updated by a concurrent comment isn't overwritten
+        doctor.save(update_fields=['specialization', 'qualification', 'experience', 'certifications', 'professional_description'])
         messages.success(request, "Professional details updated successfully!")
         return redirect('doctor_profile') 
 
@@ -241,7 +333,7 @@ def update_doctor_profile_work(request):
             messages.error(request, "Invalid consultation fee. Please enter a valid number.")
             return render(request, 'appointments/doctor_profile.html', {"doctor": doctor})
 
-        doctor.save()
+        doctor.save(update_fields=['clinic_hospital', 'address', 'availability', 'services', 'consultation_fee'])
         messages.success(request, "Work details updated successfully!")
         return redirect('doctor_profile')  
 
@@ -263,7 +355,7 @@ def update_doctor_profile_details(request):
         doctor.website = website
         doctor.languages_spoken = languages_spoken
       
-        doctor.save()
+        doctor.save(update_fields=['contact', 'website', 'languages_spoken'])
         messages.success(request, "Contact details updated successfully!")
         return redirect('doctor_profile')  
 
@@ -279,7 +371,6 @@ def update_doctor_profile_additional(request):
         real_name = request.POST.get('realName')
         date_of_birth = request.POST.get('date_of_birth')
         gender = request.POST.get('gender')
-        rating = request.POST.get('rating')
 
         if real_name:
             name_parts = real_name.split(' ', 1)
@@ -289,13 +380,9 @@ def update_doctor_profile_additional(request):
 
         doctor.date_of_birth = date_of_birth if date_of_birth else None
         doctor.gender = gender
-        try:
-            doctor.rating = float(rating) if rating else 0.0
-        except ValueError:
-            messages.error(request, "Invalid rating value.")
-            return render(request, 'appointments/doctor_profile.html', {"doctor": doctor})
+        # doctor.rating is maintained from the patients' comments and is no longer edited here
 
-        doctor.save()
+        doctor.save(update_fields=['date_of_birth', 'gender'])
         messages.success(request, "Additional details updated successfully!")
         return redirect('doctor_profile') 
 
@@ -320,11 +407,15 @@ def update_doctor_profile_availability(request):
         doctor.friday_end = request.POST.get('friday_end')
 
 
-        doctor.save()
+        doctor.save(update_fields=[
+            'monday_start', 'monday_end', 'tuesday_start', 'tuesday_end', 'wednesday_start', 'wednesday_end',
+            'thursday_start', 'thursday_end', 'friday_start', 'friday_end',
+        ])
         messages.success(request, "Availability details updated successfully!")
         return redirect('doctor_profile')  
 
 @login_required
+@query_budget(8)
 def generate_and_save_slots(request):
     if request.method == 'POST':
         try:
@@ -337,93 +428,96 @@ def generate_and_save_slots(request):
             # Parse JSON body
             data = json.loads(request.body)
             appointment_duration = int(data.get('appointment_duration'))  # Default to 30 minutes
-        except (json.JSONDecodeError, ValueError):
+        except (json.JSONDecodeError, ValueError, TypeError):
+            return JsonResponse({'status': 'error', 'message': 'Invalid data or appointment duration.'}, status=400)
+
+        if appointment_duration <= 0:
             return JsonResponse({'status': 'error', 'message': 'Invalid data or appointment duration.'}, status=400)
 
-        print(appointment_duration)
-
-        # Availability data
-        availability = {
-            'Monday': {'start': doctor.monday_start, 'end': doctor.monday_end},
-            'Tuesday': {'start': doctor.tuesday_start, 'end': doctor.tuesday_end},
-            'Wednesday': {'start': doctor.wednesday_start, 'end': doctor.wednesday_end},
-            'Thursday': {'start': doctor.thursday_start, 'end': doctor.thursday_end},
-            'Friday': {'start': doctor.friday_start, 'end': doctor.friday_end},
-        }
-
-        created_slots = []  # Track created slots for the response
-
-        # Iterate through each day
-        for day, times in availability.items():
-            start_time = times['start']
-            end_time = times['end']
-
-            if not start_time or not end_time:  # Skip days without availability
-                continue
-
-            # Parse start and end times
-            start_time = datetime.strptime(start_time, '%H:%M').time()
-            end_time = datetime.strptime(end_time, '%H:%M').time()
-
-            # Generate slots for the day
-            current_time = datetime.combine(datetime.today(), start_time)
-            end_datetime = datetime.combine(datetime.today(), end_time)
-
-            while current_time.time() < end_time:
-                slot_start = current_time.time()
-                slot_end = (current_time + timedelta(minutes=appointment_duration)).time()
-
-                # Ensure slot_end doesn't exceed end_time
-                if slot_end > end_time:
-                    break
-
-                # Save the slot to the database
-                slot, created = Slot.objects.get_or_create(
-                    doctor=doctor,
-                    day=day,
-                    start_time=slot_start,
-                    end_time=slot_end,
-                    defaults={'reserved': False}
-                )
-                if created:
-                    created_slots.append({
-                        'day': day,
-                        'start_time': slot_start.strftime('%H:%M'),
-                        'end_time': slot_end.strftime('%H:%M')
-                    })
-
-                current_time += timedelta(minutes=appointment_duration)
+        # Build the whole weekly grid in memory, then insert only the slots that don't exist yet
+        grid = build_slot_grid(doctor_availability(doctor), appointment_duration)
+        missing = save_slot_grid(doctor, grid)
+
+        if missing:
+            invalidate_availability(doctor.id)
+
+        created_slots = [
+            {
+                'day': day,
+                'start_time': slot_start.strftime('%H:%M'),
+                'end_time': slot_end.strftime('%H:%M')
+            }
+            for day, slot_start, slot_end in missing
+        ]
 
         # Return success response with created slots
         return JsonResponse({'status': 'success', 'created_slots': created_slots})
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=400)
 
+def group_slots_by_day(slots, claimed, dates):
+    # Reservations inside the booking horizon: a slot counts as reserved on a date when any claim overlaps
+    # it, the same rule booking uses
+    dates_by_day = {}
+    for date in dates:
+        dates_by_day.setdefault(date.strftime('%A'), []).append(date)
+
+    slots_by_day = {}
+    for slot in slots:
+        if slot.day not in slots_by_day:
+            slots_by_day[slot.day] = []
+        slot_reserved_dates = [
+            date for date in dates_by_day.get(slot.day, [])
+            if overlaps(claimed.get(date, ()), slot.start_time, slot.end_time)
+        ]
+        slots_by_day[slot.day].append({
+            'id': slot.id,  # Include slot ID
+            'start_time': slot.start_time.strftime('%H:%M'),
+            'end_time': slot.end_time.strftime('%H:%M'),
+            'reserved_dates': [date.strftime('%Y-%m-%d') for date in slot_reserved_dates],
+            # Kept for the existing schedule UI
+            'first_week_reserved': any(date < dates[0] + timedelta(days=7) for date in slot_reserved_dates),
+            'second_week_reserved': any(date >= dates[0] + timedelta(days=7) for date in slot_reserved_dates)
+        })
+
+    return slots_by_day
+
+@query_budget(6)
 def get_slots(request):
     if request.user.is_authenticated:
         doctor = request.user.doctor_profile  # Assuming the user is a doctor
         slots = Slot.objects.filter(doctor=doctor).order_by('day', 'start_time')
 
-        slots_by_day = {}
-        for slot in slots:
-            if slot.day not in slots_by_day:
-                slots_by_day[slot.day] = []
-            slots_by_day[slot.day].append({
-                'id': slot.id,  # Include slot ID
-                'start_time': slot.start_time.strftime('%H:%M'),
-                'end_time': slot.end_time.strftime('%H:%M'),
-                'first_week_reserved': slot.first_week_reserved,
-                'second_week_reserved': slot.second_week_reserved
-            })
+        dates = horizon_dates(datetime.today().date())
+        claimed = claimed_intervals(doctor.id, dates[0], dates[-1])
 
-        return JsonResponse({'status': 'success', 'slots': slots_by_day})
+        return JsonResponse({'status': 'success', 'slots': group_slots_by_day(slots, claimed, dates)})
 
     return JsonResponse({'status': 'error', 'message': 'User not authenticated'}, status=401)
 
+async def get_slots_async(request):
+    # ASGI version of get_slots: the worker is free while the queries run
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'User not authenticated'}, status=401)
+
+    try:
+        doctor = await Doctor.objects.aget(user=user)
+    except Doctor.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Doctor profile not found.'}, status=404)
+
+    slots = [slot async for slot in Slot.objects.filter(doctor=doctor).order_by('day', 'start_time')]
+
+    dates = horizon_dates(datetime.today().date())
+    claimed = await aclaimed_intervals(doctor.id, dates[0], dates[-1])
+
+    return JsonResponse({'status': 'success', 'slots': group_slots_by_day(slots, claimed, dates)})
+
 def delete_all_slots(request):
     if request.user.is_authenticated:
         doctor = request.user.doctor_profile
         Slot.objects.filter(doctor=doctor).delete()
+        invalidate_availability(doctor.id)
         return JsonResponse({'status': 'success', 'message': 'All slots deleted successfully'})
 
     return JsonResponse({'status': 'error', 'message': 'User not authenticated'}, status=401)
@@ -434,14 +528,16 @@ def delete_slot(request, slot_id):
             doctor = request.user.doctor_profile
             slot = Slot.objects.get(id=slot_id, doctor=doctor)
 
-            print(slot)
+            logger.debug("Deleting slot %s", slot.id)
             slot.delete()
+            invalidate_availability(doctor.id)
             return JsonResponse({'status': 'success', 'message': 'Slot deleted successfully'})
         except Slot.DoesNotExist:
             return JsonResponse({'status': 'error', 'message': 'Slot not found'}, status=404)
     return JsonResponse({'status': 'error', 'message': 'User not authenticated'}, status=401)
 
 @login_required
+@query_budget(3)
 def check_slots(request):
     if request.method == 'GET':
         try:
@@ -455,6 +551,23 @@ def check_slots(request):
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=400)
 
+async def check_slots_async(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    if request.method == 'GET':
+        try:
+            doctor = await Doctor.objects.aget(user=user)
+        except Doctor.DoesNotExist:
+            return JsonResponse({'status': 'error', 'message': 'Doctor profile not found.'}, status=404)
+
+        slots_exist = await Slot.objects.filter(doctor=doctor).aexists()
+
+        return JsonResponse({'status': 'success', 'slots_exist': slots_exist})
+
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=400)
+
 @login_required
 def add_manual_slot(request):
     if request.method == 'POST':
@@ -464,123 +577,70 @@ def add_manual_slot(request):
             return JsonResponse({'status': 'error', 'message': 'Doctor profile not found.'}, status=404)
 
         data = json.loads(request.body)
-        day = data.get('day')  # Get the day from the request
-        start_time_str = data.get('start_time')
-        end_time_str = data.get('end_time')
 
+        # A single slot is an import of one entry
+        created, conflicts = import_slots(doctor, [data])
+
+        if conflicts:
+            return JsonResponse({'status': 'error', 'message': conflicts[0]['message']}, status=400)
+
+        invalidate_availability(doctor.id)
+
+        return JsonResponse({'status': 'success', 'message': 'Slot successfully created.'})
+
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=400)
+
+
+@login_required
+def add_manual_slots_bulk(request):
+    if request.method == 'POST':
         try:
-            # Parse start and end times
-            start_time = datetime.strptime(start_time_str, '%H:%M').time()
-            end_time = datetime.strptime(end_time_str, '%H:%M').time()
-
-            if start_time >= end_time:
-                return JsonResponse({'status': 'error', 'message': 'Start time must be before end time.'}, status=400)
-
-            # Check if slot overlaps with existing ones for the same day
-            overlapping_slots = Slot.objects.filter(
-                doctor=doctor,
-                day=day,
-                start_time__lt=end_time,
-                end_time__gt=start_time
-            )
+            doctor = request.user.doctor_profile
+        except Doctor.DoesNotExist:
+            return JsonResponse({'status': 'error', 'message': 'Doctor profile not found.'}, status=404)
+
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON.'}, status=400)
 
-            if overlapping_slots.exists():
-                return JsonResponse({'status': 'error', 'message': 'Slot overlaps with an existing one.'}, status=400)
+        # Accept either a bare list of slots or {"slots": [...]}
+        entries = data.get('slots') if isinstance(data, dict) else data
 
-            # Create the new slot
-            Slot.objects.create(
-                doctor=doctor,
-                day=day,  # Use the specified day
-                start_time=start_time,
-                end_time=end_time,
-                reserved=False
-            )
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            return JsonResponse({'status': 'error', 'message': 'Expected a list of slots.'}, status=400)
 
-            return JsonResponse({'status': 'success', 'message': 'Slot successfully created.'})
+        created, conflicts = import_slots(doctor, entries)
 
-        except ValueError:
-            return JsonResponse({'status': 'error', 'message': 'Invalid time format.'}, status=400)
+        if created:
+            invalidate_availability(doctor.id)
+
+        created_slots = [
+            {
+                'day': day,
+                'start_time': start_time.strftime('%H:%M'),
+                'end_time': end_time.strftime('%H:%M')
+            }
+            for day, start_time, end_time in created
+        ]
+
+        return JsonResponse({
+            'status': 'success' if created or not conflicts else 'error',
+            'created_slots': created_slots,
+            'conflicts': conflicts,
+        }, status=200 if created or not conflicts else 400)
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=400)
 
 
 @login_required
+@query_budget(5)
 def fetch_slots_for_two_weeks(request, doctor_username):
     try:
         # Retrieve the doctor based on the username
         doctor = get_object_or_404(Doctor, user__username=doctor_username)
 
-        # Today's date
-        today = datetime.today().date()
-
-        # Generate the next 14 days with their corresponding day names and week numbers
-        next_two_weeks = []
-        for i in range(14):
-            current_date = today + timedelta(days=i)
-            day_name = current_date.strftime('%A')
-            week_number = 1 if i < 7 else 2  # First week: days 0-6, Second week: days 7-13
-            next_two_weeks.append({
-                'date': current_date,
-                'day_name': day_name,
-                'week': week_number
-            })
-
-        # Extract unique day names to minimize database queries
-        unique_day_names = {day['day_name'] for day in next_two_weeks}
-
-        # Query slots matching the day names for the doctor
-        slots = Slot.objects.filter(
-            doctor=doctor,
-            day__in=unique_day_names
-        ).order_by('day', 'start_time')
-
-        # Organize slots by day name for quick access
-        slots_by_day = {}
-        for slot in slots:
-            slots_by_day.setdefault(slot.day, []).append({
-                'id': slot.id,
-                'start_time': slot.start_time.strftime('%I:%M %p'),
-                'end_time': slot.end_time.strftime('%I:%M %p'),
-                'start_time_24h': slot.start_time.strftime('%H:%M'),
-                'end_time_24h': slot.end_time.strftime('%H:%M'),
-                'first_week_reserved': slot.first_week_reserved,
-                'second_week_reserved': slot.second_week_reserved
-            })
-
-        # Prepare the slots data structured by date, filtering based on reservation status
-        slots_by_date = {}
-        for entry in next_two_weeks:
-            date = entry['date']
-            date_str = date.strftime('%Y-%m-%d')
-            day_name = entry['day_name']
-            week = entry['week']
-            all_slots = slots_by_day.get(day_name, [])
-
-            # Filter slots based on the week and reservation status
-            if week == 1:
-                available_slots = [
-                    {
-                        'start_time': slot['start_time'],
-                        'end_time': slot['end_time'],
-                        'start_time_24h': slot['start_time_24h'],
-                        'end_time_24h': slot['end_time_24h']
-                    }
-                    for slot in all_slots if not slot['first_week_reserved']
-                ]
-            else:
-                available_slots = [
-                    {
-                        'start_time': slot['start_time'],
-                        'end_time': slot['end_time'],
-                        'start_time_24h': slot['start_time_24h'],
-                        'end_time_24h': slot['end_time_24h']
-                    }
-                    for slot in all_slots if not slot['second_week_reserved']
-                ]
-
-            slots_by_date[date_str] = available_slots
-
-        return JsonResponse({'status': 'success', 'slots': slots_by_date})
+        return JsonResponse({'status': 'success', 'slots': cached_available_slots_by_date(doctor)})
 
     except Exception as e:
         # Log the exception if necessary
@@ -588,60 +648,47 @@ def fetch_slots_for_two_weeks(request, doctor_username):
 
 
 @login_required
+@query_budget(5)
 def fetch_slots_for_two_weeks_by_id(request, doctor_id):
     try:
         doctor = get_object_or_404(Doctor, id=doctor_id)  # Get the doctor by id
 
-        # Define the next 14 days with their corresponding dates and day names
-        today = datetime.today()
-        next_two_weeks = [
-            {
-                'date': today + timedelta(days=i),
-                'day_name': (today + timedelta(days=i)).strftime('%A')
-            }
-            for i in range(14)
-        ]
-
-        # Extract unique day names to minimize database queries
-        unique_day_names = {day['day_name'] for day in next_two_weeks}
-
-        # Determine the week (first or second) for each day in the next two weeks
-        slots_by_date = {}
-        for i, entry in enumerate(next_two_weeks):
-            date_obj = entry['date']
-            day_name = entry['day_name']
-            reserved_field = 'first_week_reserved' if i < 7 else 'second_week_reserved'
-
-            # Query slots for the specific day and exclude reserved slots
-            slots = Slot.objects.filter(
-                doctor=doctor,
-                day=day_name,
-                **{reserved_field: False}  # Exclude reserved slots
-            ).order_by('start_time')
-
-            # Format slots for JSON response
-            formatted_slots = [
-                {
-                    'start_time': slot.start_time.strftime('%I:%M %p'),
-                    'end_time': slot.end_time.strftime('%I:%M %p'),
-                    'start_time_24h': slot.start_time.strftime('%H:%M'),
-                    'end_time_24h': slot.end_time.strftime('%H:%M'),
-                }
-                for slot in slots
-            ]
-
-            # Add slots to the corresponding date
-            date_str = date_obj.strftime('%Y-%m-%d')
-            slots_by_date[date_str] = formatted_slots
-
-        return JsonResponse({'status': 'success', 'slots': slots_by_date})
+        return JsonResponse({'status': 'success', 'slots': cached_available_slots_by_date(doctor)})
 
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 
+async def fetch_slots_for_two_weeks_async(request, doctor_username):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    try:
+        doctor = await Doctor.objects.aget(user__username=doctor_username)
+    except Doctor.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Doctor not found.'}, status=404)
+
+    return JsonResponse({'status': 'success', 'slots': await acached_available_slots_by_date(doctor)})
+
+
+async def fetch_slots_for_two_weeks_by_id_async(request, doctor_id):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+
+    try:
+        doctor = await Doctor.objects.aget(id=doctor_id)
+    except Doctor.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Doctor not found.'}, status=404)
+
+    return JsonResponse({'status': 'success', 'slots': await acached_available_slots_by_date(doctor)})
+
+
 
 @login_required
+# 16 on either path with an eager Celery, which drains the outbox inside the request; 10 with a worker
+@query_budget(18)
 def book_appointment(request):
     if request.method == 'POST':
         try:
@@ -671,109 +718,138 @@ def book_appointment(request):
             if start_datetime >= end_datetime:
                 return JsonResponse({'error': 'Start time must be earlier than end time.'}, status=400)
 
-            # Convert date to day of the week
             try:
                 date_obj = datetime.strptime(date, "%Y-%m-%d")
             except ValueError:
                 return JsonResponse({'error': 'Invalid date format.'}, status=400)
 
-            day_of_week = calendar.day_name[date_obj.weekday()]  # E.g., "Monday"
-
             # Determine the current date
             today = datetime.today().date()
             selected_date = date_obj.date()
             delta_days = (selected_date - today).days
 
+            horizon = booking_horizon()
+
             if delta_days < 0:
                 return JsonResponse({'error': 'Selected date is in the past.'}, status=400)
-            elif 0 <= delta_days < 7:
-                # Week 1
-                reserved_field = 'first_week_reserved'
-            elif 7 <= delta_days < 14:
-                # Week 2
-                reserved_field = 'second_week_reserved'
-            else:
-                return JsonResponse({'error': 'Selected date is beyond the reservation period (14 days).'}, status=400)
+            elif delta_days >= horizon:
+                return JsonResponse({'error': f'Selected date is beyond the reservation period ({horizon} days).'}, status=400)
 
-            slot_exists = Slot.objects.filter(
-                doctor_id=doctor_id,
-                day=day_of_week,
-                start_time=start_datetime.time(),
-                end_time=end_datetime.time(),
-                **{reserved_field: False}  # Dynamically set the reserved field
-            ).exists()
 
-            if not slot_exists:
-                return JsonResponse({'error': 'The selected slot does not exist.'}, status=400)
+            # Get the doctor
+            doctor = get_object_or_404(Doctor, id=doctor_id)
 
+            # Get the client profile
+            try:
+                client = request.user.client_profile
+            except AttributeError:
+                return JsonResponse({'error': 'Client profile not found.'}, status=400)
+
+            appointment_fields = dict(
+                doctor_name=f"Dr. {doctor.user.first_name} {doctor.user.last_name}",
+                doctor_gender=doctor.gender,
+                doctor_contact=doctor.contact,
+                doctor_address=doctor.address,
+                doctor_clinic=doctor.clinic_hospital,
+
+                duration=(end_datetime - start_datetime).seconds // 60,
+                status=False,
+                one_time_only=one_time,
+
+                client_id=client.user.id,
+                client_name=f"{client.user.first_name} {client.user.last_name}",
+                client_gender=client.gender,
+                client_contact=client.contact,
+                client_address = client.address,
+                client_date_of_birth = client.date_of_birth,
+            )
 
             # Handle one-time appointments
             if one_time:
-                # Get the doctor
-                doctor = get_object_or_404(Doctor, id=doctor_id)
+                # Claim the slot for this date and create the appointment atomically
+                try:
+                    appointment = claim_slot(
+                        doctor.id,
+                        selected_date,
+                        start_datetime.time(),
+                        end_datetime.time(),
+                        **appointment_fields
+                    )
+                except SlotUnavailable as e:
+                    return JsonResponse({'error': str(e)}, status=400)
+
+                appointments = [appointment]
+                token_payload = appointment.id
+
+            # Handle recurring appointments
+            else:
+                try:
+                    series_end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+                except (TypeError, ValueError):
+                    return JsonResponse({'error': 'Invalid end date format.'}, status=400)
+
+                try:
+                    repeat_every = int(repeat_every)
+                except (TypeError, ValueError):
+                    return JsonResponse({'error': 'Invalid repeat interval.'}, status=400)
+
+                try:
+                    series_dates = expand_series(selected_date, series_end_date, repeat_every, repeat_unit)
+                except ValueError as e:
+                    return JsonResponse({'error': str(e)}, status=400)
 
-                    # Get the client profile
+                # Nothing to book means nothing to confirm: never queue an email for an empty series
+                if not series_dates:
+                    return JsonResponse({'error': 'The recurring series has no dates.'}, status=400)
+
+                # Check every occurrence in one go and create the whole series, or nothing
                 try:
-                    client = request.user.client_profile
-                except AttributeError:
-                    return JsonResponse({'error': 'Client profile not found.'}, status=400)
-
-                appointment = Appointment.objects.create(
-                    doctor_id=doctor.id,
-                    doctor_name=f"Dr. {doctor.user.first_name} {doctor.user.last_name}",
-                    doctor_gender=doctor.gender,
-                    doctor_contact=doctor.contact,
-                    doctor_address=doctor.address,
-                    doctor_clinic=doctor.clinic_hospital,
-
-                    start_date=start_datetime.date(),
-                    start_time=start_datetime.time(),
-                    end_time=end_datetime.time(),
-                    duration=(end_datetime - start_datetime).seconds // 60,
-                    status=False,
-                    one_time_only=True,
-
-                    client_id=client.user.id,
-                    client_name=f"{client.user.first_name} {client.user.last_name}",
-                    client_gender=client.gender,
-                    client_contact=client.contact,
-                    client_address = client.address,
-                    client_date_of_birth = client.date_of_birth,
-                )
-
-                # Generate the email confirmation link
-                token = serializer.dumps(appointment.id, salt="appointment-confirmation")
-                confirmation_link = f'{settings.RESET_LINK_BASE_URL}/confirm-appointment-by-link/{token}/'
-
-                send_mail(
-                    subject='Appointment Confirmation',
-                    message=(
-                        f"Dear {client.user.first_name} {client.user.last_name},\n\n"
-                        f"Your appointment details are as follows:\n"
-                        f"Doctor: Dr. {doctor.user.first_name} {doctor.user.last_name}\n"
-                        f"Clinic: {doctor.clinic_hospital}\n"
-                        f"Address: {doctor.address}\n"
-                        f"Date: {start_datetime.date()}\n"
-                        f"Time: {start_datetime.time()} - {end_datetime.time()}\n"
-                        f"Duration: {(end_datetime - start_datetime).seconds // 60} minutes\n\n"
-                        f"To confirm your appointment, please click the following link:\n"
-                        f"{confirmation_link}\n\n"
-                        f"Thank you,\n"
-                        f"Your Clinic Team"
-                    ),
-                    from_email='mihnea.e@bridge-global.com',
-                    recipient_list=['mihnea.encean2@gmail.com'],
-                    fail_silently=False,
-                )
-
-
-                messages.success(request, "Appointment booked successfully! An email has been sent to confirm your appointment. Please check your inbox.")
-
-                return redirect('client_appointments')
-                #return JsonResponse({'success': 'Appointment booked successfully!'}, status=200)
-
-            if not one_time:
-                return JsonResponse({'error': 'Recurring appointments are not yet implemented. One time must be checked'}, status=400)
+                    appointments = claim_series(
+                        doctor.id,
+                        series_dates,
+                        start_datetime.time(),
+                        end_datetime.time(),
+                        **appointment_fields
+                    )
+                except SeriesConflict as e:
+                    return JsonResponse({
+                        'error': str(e),
+                        'conflicts': [conflict.strftime('%Y-%m-%d') for conflict in e.dates],
+                    }, status=400)
+
+                token_payload = [appointment.id for appointment in appointments]
+
+            invalidate_availability(doctor.id)
+
+            # Generate the email confirmation link
+            token = serializer.dumps(token_payload, salt="appointment-confirmation")
+            confirmation_link = f'{settings.RESET_LINK_BASE_URL}/confirm-appointment-by-link/{token}/'
+
+            queue_mail(
+                subject='Appointment Confirmation',
+                message=(
+                    f"Dear {client.user.first_name} {client.user.last_name},\n\n"
+                    f"Your appointment details are as follows:\n"
+                    f"Doctor: Dr. {doctor.user.first_name} {doctor.user.last_name}\n"
+                    f"Clinic: {doctor.clinic_hospital}\n"
+                    f"Address: {doctor.address}\n"
+                    f"Date: {', '.join(str(appointment.start_date) for appointment in appointments)}\n"
+                    f"Time: {start_datetime.time()} - {end_datetime.time()}\n"
+                    f"Duration: {(end_datetime - start_datetime).seconds // 60} minutes\n\n"
+                    f"To confirm your appointment, please click the following link:\n"
+                    f"{confirmation_link}\n\n"
+                    f"Thank you,\n"
+                    f"Your Clinic Team"
+                ),
+                from_email='mihnea.e@bridge-global.com',
+                recipient_list=['mihnea.encean2@gmail.com'],
+            )
+
+
+            messages.success(request, "Appointment booked successfully! An email has been sent to confirm your appointment. Please check your inbox.")
+
+            return redirect('client_appointments')
+            #return JsonResponse({'success': 'Appointment booked successfully!'}, status=200)
 
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
@@ -781,16 +857,84 @@ def book_appointment(request):
     return JsonResponse({'error': 'Invalid request method.'}, status=405)
 
 
+@login_required
+def book_appointments_batch(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method.'}, status=405)
+
+    # Front desk and partner imports only
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Not allowed.'}, status=403)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON.'}, status=400)
+
+    items = data.get('bookings') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return JsonResponse({'error': 'Expected a list of bookings.'}, status=400)
+
+    max_items = getattr(settings, 'BATCH_BOOKING_MAX_ITEMS', 500)
+    if len(items) > max_items:
+        return JsonResponse({'error': f'A batch can contain at most {max_items} bookings.'}, status=400)
+
+    results, appointments = book_batch(items)
+
+    # Confirmation emails go through the outbox in one INSERT
+    client_emails = dict(User.objects.filter(
+        id__in={appointment.client_id for appointment in appointments}
+    ).values_list('id', 'email'))
+
+    emails = []
+    for appointment in appointments:
+        token = serializer.dumps(appointment.id, salt="appointment-confirmation")
+        confirmation_link = f'{settings.RESET_LINK_BASE_URL}/confirm-appointment-by-link/{token}/'
+        emails.append((
+            'Appointment Confirmation',
+            (
+                f"Dear {appointment.client_name},\n\n"
+                f"Your appointment details are as follows:\n"
+                f"Doctor: {appointment.doctor_name}\n"
+                f"Clinic: {appointment.doctor_clinic}\n"
+                f"Address: {appointment.doctor_address}\n"
+                f"Date: {appointment.start_date}\n"
+                f"Time: {appointment.start_time} - {appointment.end_time}\n"
+                f"Duration: {appointment.duration} minutes\n\n"
+                f"To confirm your appointment, please click the following link:\n"
+                f"{confirmation_link}\n\n"
+                f"Thank you,\n"
+                f"Your Clinic Team"
+            ),
+            'mihnea.e@bridge-global.com',
+            [client_emails.get(appointment.client_id)],
+        ))
+    queue_mails([email for email in emails if email[3][0]])
+
+    return JsonResponse({
+        'status': 'success',
+        'booked': len(appointments),
+        'results': results,
+    })
+
+
 def confirm_appointment(request, token):
     try:
-        appointment_id = serializer.loads(token, salt="appointment-confirmation", max_age=3600)  # Token valid for 1 hour
-        appointment = Appointment.objects.get(id=appointment_id)
+        appointment_ids = serializer.loads(token, salt="appointment-confirmation", max_age=confirmation_max_age())
+
+        # A recurring series is confirmed with a single link carrying all of its ids
+        if not isinstance(appointment_ids, list):
+            appointment_ids = [appointment_ids]
 
-        if appointment.status:
+        appointments = Appointment.objects.filter(id__in=appointment_ids)
+        if not appointments.exists():
+            raise Appointment.DoesNotExist
+
+        if not appointments.filter(status=False).exists():
             messages.info(request, "This appointment has already been confirmed.")
         else:
-            appointment.status = True
-            appointment.save()
+            appointments.filter(status=False).update(status=True)
+            release_holds(appointment_ids)
             messages.success(request, "Your appointment has been successfully confirmed!")
     except (Appointment.DoesNotExist, ValueError):
         messages.error(request, "Invalid or expired confirmation link.")
@@ -804,8 +948,9 @@ def upload_clinic_photo(request):
         clinic_photo = request.FILES.get('clinic_photo')
         if clinic_photo:
             doctor = request.user.doctor_profile
-            doctor.clinic_picture = clinic_photo
-            doctor.save()
+            doctor.clinic_picture = store_upload(clinic_photo, 'clinic')
+            doctor.save(update_fields=['clinic_picture'])
+            queue_thumbnails(doctor.clinic_picture.name)
             return redirect('doctor_profile')  
 
 
@@ -912,7 +1057,6 @@ def send_reset_email_client(request):
     if request.method == 'POST':
         email = request.POST.get('email')
 
-        print(email)
         try:
             user = User.objects.get(email=email)
         except User.DoesNotExist:
@@ -924,12 +1068,11 @@ def send_reset_email_client(request):
 
         reset_link = f'{settings.RESET_LINK_BASE_URL}/reset-password-by-link/{uid}/{token}/'
 
-        send_mail(
+        queue_mail(
             subject='Password Reset Request',
             message=f'Click this link to reset your password: {reset_link}',
             from_email='mihnea.e@bridge-global.com',  
             recipient_list=[email],
-            fail_silently=False,
         )
 
         messages.success(request, 'Email sent successfully! Please check your inbox.')
@@ -945,7 +1088,6 @@ def send_reset_email_doctor(request):
     if request.method == 'POST':
         email = request.POST.get('email')
 
-        print(email)
         try:
             user = User.objects.get(email=email)
         except User.DoesNotExist:
@@ -957,12 +1099,11 @@ def send_reset_email_doctor(request):
 
         reset_link = f'{settings.RESET_LINK_BASE_URL}/reset-password-by-link/{uid}/{token}/'
 
-        send_mail(
+        queue_mail(
             subject='Password Reset Request',
             message=f'Click this link to reset your password: {reset_link}',
             from_email='mihnea.e@bridge-global.com',  
             recipient_list=[email],
-            fail_silently=False,
         )
 
         messages.success(request, 'Email sent successfully! Please check your inbox.')
@@ -995,12 +1136,11 @@ def send_contact_site_email(request):
         recipient_list = ['mihnea.encean2@gmail.com']  
         
         try:
-            send_mail(
+            queue_mail(
                 subject,
                 body,
                 'mihnea.e@bridge-global.com',  
                 recipient_list,
-                fail_silently=False,  
             )
 
             return JsonResponse({'status': 'success', 'message': 'Email sent successfully!'})
@@ -1034,95 +1174,154 @@ def reset_password_view(request, uidb64, token):
         messages.error(request, "The reset password link is invalid or expired.")
         return render(request, 'appointments/reset_password.html', {'validlink': False})
 
+@cache_public_page
 def about(request):
     return render(request, 'appointments/about.html')
 
-def doctor_appointments(request):
-    try:
-        doctor = request.user.doctor_profile
-    except Doctor.DoesNotExist:
-        messages.error(request, "Doctor profile not found.")
-
-    appointments = Appointment.objects.filter(doctor_id=doctor.id).order_by('-start_date', '-start_time')
+def render_appointments_page(request, appointments, template_name):
+    current_time = datetime.now()
+    today = current_time.date()
 
-    current_time = now()
+    # An appointment stays active until its end time on its own date
+    active = Q(start_date__gt=today) | Q(start_date=today, end_time__gt=current_time.time())
 
-    total_appointments = appointments.count()
-    finished_appointments = appointments.filter(end_time__lte=current_time.time(), start_date__lte=current_time.date()).count()
-    active_appointments = appointments.filter(end_time__gt=current_time.time(), start_date__gte=current_time.date()).count()
+    # Totals in one conditional aggregate instead of a COUNT per bucket
+    counts = appointments.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=active),
+    )
 
-    current_time_for_compare = timezone.now()
+    try:
+        page, next_cursor = keyset_page(
+            appointments,
+            [('start_date', True), ('start_time', True), ('id', True)],
+            cursor=request.GET.get('cursor'),
+            page_size=getattr(settings, 'APPOINTMENTS_PER_PAGE', 50),
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor.')
 
-    for appointment in appointments:
+    for appointment in page:
         appointment.is_active = (
-            appointment.start_date >= current_time_for_compare.date() and 
-            appointment.end_time > current_time_for_compare.time()
-        )   
-
-    active_appointments_filtered = appointments.filter(
-        end_time__gt=current_time.time(),
-        start_date__gte=current_time.date()
-    )
-
-    finished_appointments_filtered = appointments.filter(
-        end_time__lte=current_time.time(),
-    )
+            appointment.start_date > today or
+            (appointment.start_date == today and appointment.end_time > current_time.time())
+        )
 
     context  = {
-        'appointments': appointments,
-        'active_appointments_filtered': active_appointments_filtered,
-        'finished_appointments_filtered': finished_appointments_filtered,
-        'total_appointments': total_appointments,
-        'finished_appointments': finished_appointments,
-        'active_appointments': active_appointments,
+        'appointments': page,
+        'active_appointments_filtered': [appointment for appointment in page if appointment.is_active],
+        'finished_appointments_filtered': [appointment for appointment in page if not appointment.is_active],
+        'total_appointments': counts['total'],
+        'finished_appointments': counts['total'] - counts['active'],
+        'active_appointments': counts['active'],
         'current_date': current_time.strftime('%d %b %Y'),
+        'next_cursor': next_cursor,
     }
 
-    return render(request, 'appointments/doctor_appointments.html', context)
+    return render(request, template_name, context)
 
+@query_budget(7)
+def doctor_appointments(request):
+    try:
+        doctor = request.user.doctor_profile
+    except Doctor.DoesNotExist:
+        messages.error(request, "Doctor profile not found.")
+        return redirect('home')
+
+    appointments = Appointment.objects.filter(doctor_id=doctor.id)
+
+    return render_appointments_page(request, appointments, 'appointments/doctor_appointments.html')
+
+@query_budget(7)
 def client_appointments(request):
     try:
         client = request.user.client_profile  
     except Client.DoesNotExist:
         messages.error(request, "Client profile not found.")
+        return redirect('home')
 
-    appointments = Appointment.objects.filter(client_id=request.user.id).order_by('-start_date', '-start_time')
-
-    current_time = now()
+    appointments = Appointment.objects.filter(client_id=request.user.id)
 
-    total_appointments = appointments.count()
-    finished_appointments = appointments.filter(end_time__lte=current_time.time(), start_date__lte=current_time.date()).count()
-    active_appointments = appointments.filter(end_time__gt=current_time.time(), start_date__gte=current_time.date()).count()
+    return render_appointments_page(request, appointments, 'appointments/client_appointments.html')
 
-    current_time_for_compare = timezone.now()
+@login_required
+def export_appointments(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return JsonResponse({'status': 'error', 'message': 'Format must be csv or ndjson.'}, status=400)
+
+    # Doctors export their own schedule; staff can export any doctor or a whole clinic
+    if request.user.is_staff:
+        filters = {}
+        if request.GET.get('doctor_id'):
+            # Validated here: a bad value would otherwise only fail inside the streaming generator
+            try:
+                filters['doctor_id'] = int(request.GET.get('doctor_id'))
+            except ValueError:
+                return JsonResponse({'status': 'error', 'message': 'Invalid doctor id.'}, status=400)
+        if request.GET.get('clinic'):
+            filters['doctor_clinic'] = request.GET.get('clinic')
+    else:
+        try:
+            doctor = request.user.doctor_profile
+        except Doctor.DoesNotExist:
+            return JsonResponse({'status': 'error', 'message': 'Doctor profile not found.'}, status=404)
+        filters = {'doctor_id': doctor.id}
 
-    for appointment in appointments:
-        appointment.is_active = (
-            appointment.start_date >= current_time_for_compare.date() and 
-            appointment.end_time > current_time_for_compare.time()
-        )   
+    try:
+        if request.GET.get('start'):
+            filters['start_date__gte'] = datetime.strptime(request.GET.get('start'), '%Y-%m-%d').date()
+        if request.GET.get('end'):
+            filters['start_date__lte'] = datetime.strptime(request.GET.get('end'), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid date format.'}, status=400)
+
+    rows = export_rows(filters)
+
+    if export_format == 'csv':
+        response = StreamingHttpResponse(csv_lines(rows), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="appointments.csv"'
+    else:
+        response = StreamingHttpResponse(ndjson_lines(rows), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="appointments.ndjson"'
 
-    active_appointments_filtered = appointments.filter(
-        end_time__gt=current_time.time(),
-        start_date__gte=current_time.date()
-    )
+    return response
 
-    finished_appointments_filtered = appointments.filter(
-        end_time__lte=current_time.time(),
-        start_date__lte=current_time.date()
+@login_required
+def calendar_feed_link(request):
+    # Personal, unguessable feed URL to paste into Outlook / Google Calendar. POST issues a new one and
+    # revokes the old, e.g. when a link leaked.
+    nonce = feed_nonce(request.user, rotate=request.method == 'POST')
+    token = serializer.dumps({'user': request.user.id, 'nonce': nonce}, salt="calendar-feed")
+    return JsonResponse({'status': 'success', 'url': f'{settings.RESET_LINK_BASE_URL}/calendar-feed/{token}/'})
+
+def calendar_feed(request, token):
+    # No max_age: calendar clients keep polling the same URL for months; revocation is by rotating the nonce
+    try:
+        owner = serializer.loads(token, salt="calendar-feed")
+        filters = feed_filters(owner['user'], owner['nonce'])
+    except (BadSignature, TypeError, KeyError):
+        return HttpResponseNotFound()
+
+    if filters is None:
+        return HttpResponseNotFound()
+
+    appointments, since = feed_appointments(filters)
+
+    # Calendar clients poll every few minutes; answer with 304 before building anything when nothing changed
+    etag = feed_etag(appointments, since)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+
+    response = StreamingHttpResponse(
+        ical_lines(appointments, 'Appointments', request.get_host()),
+        content_type='text/calendar; charset=utf-8',
     )
-
-    context  = {
-        'appointments': appointments,
-        'active_appointments_filtered': active_appointments_filtered,
-        'finished_appointments_filtered': finished_appointments_filtered,
-        'total_appointments': total_appointments,
-        'finished_appointments': finished_appointments,
-        'active_appointments': active_appointments,
-        'current_date': current_time.strftime('%d %b %Y'),
-    }
-
-    return render(request, 'appointments/client_appointments.html', context)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
 
 def client_profile(request):
     try:
@@ -1132,6 +1331,7 @@ def client_profile(request):
     
     return render(request, 'appointments/client_profile.html', {"client" : client})
 
+@query_budget(5)
 def doctor_profile(request):
     try:
         doctor = request.user.doctor_profile
@@ -1168,6 +1368,7 @@ def doctor_profile(request):
     return render(request, 'appointments/doctor_profile.html', context)
 
 
+@cache_public_page
 def contact(request):
 
     
@@ -1175,17 +1376,30 @@ def contact(request):
 
     return render(request, 'appointments/contact.html')
 
+@cache_public_page
 def subscription(request):
     return render(request, 'appointments/subscription.html')
 
 def forgot_password(request):
     return render(request, 'appointments/forgot_password.html')
 
+@query_budget(7)
 def search_results(request):
     query = request.GET.get('q', '')
 
-    return render(request, 'appointments/search_results.html', {'query': query})
+    # Ranked hits from the search index, resolved to doctors / specialties one page at a time
+    paginator = Paginator(search(query), getattr(settings, 'SEARCH_RESULTS_PER_PAGE', 20))
+    page_obj = paginator.get_page(request.GET.get('page'))
+    results = load_hits(page_obj.object_list)
+
+    return render(request, 'appointments/search_results.html', {
+        'query': query,
+        'results': results,
+        'page_obj': page_obj,
+    })
 
+@cache_public_page
+@query_budget(6)
 def view_doctor_profile_by_cli(request, username):
     doctor = get_object_or_404(Doctor, user__username=username)
 